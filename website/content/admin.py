@@ -1,9 +1,9 @@
-import difflib
 from datetime import datetime
 from pytz import UTC
 
 from django.contrib import messages
 from django.contrib.admin import ModelAdmin
+from django.contrib.admin.views.main import ChangeList
 from django.contrib.admin.utils import unquote
 from django.core.exceptions import PermissionDenied
 from django.core.urlresolvers import reverse
@@ -17,7 +17,12 @@ from django.utils.translation import ngettext
 
 from mptt.admin import DraggableMPTTAdmin
 
-from content.models import BlogEntry, MenuEntry, Page, PageHistory, PUBLISH_STATUS_CHOICES
+from content import search
+from content.cache import get_cached_diff, set_cached_diff
+from content.diff import make_table
+from content.models import (
+	BlogEntry, MenuEntry, Page, PageHistory, PUBLISH_STATUS_CHOICES
+)
 from layout.models import get_templates
 from website.admin import admin_site
 
@@ -27,6 +32,18 @@ def view_on_site_inline(obj):
 view_on_site_inline.short_description = 'View on site'
 
 
+class PageChangeList(ChangeList):
+	def get_queryset(self, request):
+		# The list doesn't show the text, so don't load it.
+		return super(PageChangeList, self).get_queryset(request).defer(
+			'content', 'extra_header_content'
+		)
+
+	def get_results(self, request):
+		super(PageChangeList, self).get_results(request)
+		request.page_changelist_results = self.result_list
+
+
 class PageAdmin(DraggableMPTTAdmin):
 	mptt_indent_field = 'title'
 	list_display = (
@@ -37,7 +54,35 @@ class PageAdmin(DraggableMPTTAdmin):
 	actions = ('change_template', 'change_status',)
 	actions_on_top = False
 	actions_on_bottom = True
-	search_fields = ['alias', 'title']
+	# Searched in get_search_results, against the unique index on the alias.
+	search_fields = ['=alias']
+	# Pages are shown in tree order, which is indexed, so paging through
+	# them stays cheap however many there are.
+	list_per_page = 200
+	show_full_result_count = False
+
+	def get_search_results(self, request, queryset, search_term):
+		# The alias isn't in the full-text index, so whole ones are looked up
+		# too. Django would use iexact, which can't use the index.
+		found = queryset.filter(alias=search_term.strip())
+		return found | search.filter_queryset(queryset, 'P', search_term), False
+
+	def get_changelist(self, request, **kwargs):
+		return PageChangeList
+
+	def _build_tree_structure(self, queryset):
+		# Built by _tree_context from the rows already loaded instead.
+		return {}
+
+	def _tree_context(self, request):
+		# Only the pages on this page of the list can be collapsed, so there's
+		# no need to load the whole tree.
+		context = super(PageAdmin, self)._tree_context(request)
+		structure = {}
+		for page in getattr(request, 'page_changelist_results', []):
+			structure.setdefault(str(page.parent_id) if page.parent_id else 0, []).append(page.pk)
+		context['treeStructure'] = structure
+		return context
 
 	def changelist_view(self, request, extra_context=None):
 		extra_context = extra_context or {}
@@ -47,7 +92,7 @@ class PageAdmin(DraggableMPTTAdmin):
 
 	def change_template(self, request, queryset):
 		new_template = request.POST.get('action-template')
-		updated = queryset.update(template=new_template)
+		updated = Page.bulk_update(queryset, request.user, template=new_template)
 		messages.success(request, '%d %s changed to %s' %
 			(updated, ngettext('page', 'pages', updated), new_template)
 		)
@@ -55,7 +100,7 @@ class PageAdmin(DraggableMPTTAdmin):
 
 	def change_status(modeladmin, request, queryset):
 		new_status = request.POST.get('action-status')
-		updated = queryset.update(status=new_status)
+		updated = Page.bulk_update(queryset, request.user, status=new_status)
 		for value, name in PUBLISH_STATUS_CHOICES:
 			if value == new_status:
 				break
@@ -249,23 +294,7 @@ class PageAdmin(DraggableMPTTAdmin):
 				raise Http404
 
 		if 'revision' in request.GET:
-			def _format_line(self, side, flag, linenum, text):
-				try:
-					linenum = '%d' % linenum
-				except TypeError:
-					# handle blank lines where linenum is '>' or ''
-					pass
-				# replace those things that would get confused with HTML symbols
-				text = text.replace('&', '&amp;').replace('>', '&gt;').replace('<', '&lt;')
-
-				return '<td>%s</td><td>%s</td>' % (linenum, text)
-
-			differ = difflib.HtmlDiff()
-			setattr(differ, '_table_template', '<table class="diff">%(data_rows)s</table>')
-			setattr(difflib.HtmlDiff, '_format_line', _format_line)
-
 			try:
-				previous = ['']
 				current_version = obj.revisions.get(pk=request.GET['revision'])
 				if 'compare' in request.GET:
 					previous_version = obj.revisions.get(pk=request.GET['compare'])
@@ -273,10 +302,21 @@ class PageAdmin(DraggableMPTTAdmin):
 					previous_version = obj
 				else:
 					previous_version = obj.revisions.filter(pk__lt=request.GET['revision']).last()
-				if previous_version is not None:
-					previous = previous_version.content.splitlines()
-				current = current_version.content.splitlines()
-				current_version.diff = differ.make_table(previous, current, context=True, numlines=4)
+
+				diff = None
+				cacheable = current_version.type == 'H' and (
+					previous_version is None or
+					(isinstance(previous_version, PageHistory) and previous_version.type == 'H')
+				)
+				previous_id = previous_version.pk if previous_version is not None else None
+				if cacheable:
+					diff = get_cached_diff(previous_id, current_version.pk)
+				if diff is None:
+					previous = previous_version.content if previous_version is not None else ''
+					diff = make_table(previous, current_version.content)
+					if cacheable:
+						set_cached_diff(previous_id, current_version.pk, diff)
+				current_version.diff = diff
 				context['this_version'] = current_version
 				context['previous_revision'] = obj.history_set.filter(pk__lt=current_version.pk).first()
 				context['next_revision'] = obj.history_set.filter(pk__gt=current_version.pk).last()
@@ -310,9 +350,16 @@ class BlogEntryAdmin(ModelAdmin):
 	list_filter = ('status',)
 	actions = ('make_published',)
 	ordering = ('-created',)
+	# Searched in get_search_results, like PageAdmin's. The title is in the
+	# full-text index.
+	search_fields = ['=slug']
+
+	def get_search_results(self, request, queryset, search_term):
+		found = queryset.filter(slug=search_term.strip())
+		return found | search.filter_queryset(queryset, 'B', search_term), False
 
 	def make_published(modeladmin, request, queryset):
-		queryset.update(status='P')
+		BlogEntry.bulk_update(queryset, request.user, status='P')
 	make_published.short_description = 'Mark selected entries as published'
 
 	def view_on_site(self, obj):
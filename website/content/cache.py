@@ -0,0 +1,110 @@
+from hashlib import md5
+import time
+
+from django.core.cache import cache
+
+from website import settings
+
+PAGE_VERSION_KEY = 'content:page_version'
+FEED_VERSION_KEY = 'content:feed_version'
+DIFF_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def _get_version(key):
+	version = cache.get(key)
+	if version is None:
+		# Start from the current time rather than 1, so that if the version is
+		# evicted we don't go back to serving entries stored under an old one.
+		cache.add(key, int(time.time() * 1000), None)
+		version = cache.get(key)
+	return version
+
+
+def _bump_version(key):
+	try:
+		cache.incr(key)
+	except ValueError:
+		cache.set(key, int(time.time() * 1000), None)
+
+
+def page_cache_key(path):
+	return 'content:page:%s:%s' % (
+		_get_version(PAGE_VERSION_KEY), md5(path.encode('utf-8')).hexdigest()
+	)
+
+
+def get_cached_page(path):
+	return cache.get(page_cache_key(path))
+
+
+def set_cached_page(path, response, etag, last_modified):
+	cache.set(
+		page_cache_key(path),
+		(response.content, response['Content-Type'], etag, last_modified),
+		settings.PAGE_CACHE_TIMEOUT
+	)
+
+
+def invalidate_pages():
+	# A page's URL, the menu and the templates all appear on other pages, so
+	# rather than working out which pages are affected, drop them all.
+	_bump_version(PAGE_VERSION_KEY)
+
+
+def page_list_cache_key(query):
+	# Under the page version, so any change to a page starts a new list.
+	return 'content:page_list:%s:%s' % (
+		_get_version(PAGE_VERSION_KEY), md5(query.encode('utf-8')).hexdigest()
+	)
+
+
+def get_cached_page_list(key):
+	return cache.get(key)
+
+
+def set_cached_page_list(key, content):
+	cache.set(key, content, settings.PAGE_CACHE_TIMEOUT)
+
+
+def feed_cache_key(url):
+	return 'content:feed:%s:%s' % (
+		_get_version(FEED_VERSION_KEY), md5(url.encode('utf-8')).hexdigest()
+	)
+
+
+def get_cached_feed(url):
+	return cache.get(feed_cache_key(url))
+
+
+def set_cached_feed(url, feed):
+	cache.set(feed_cache_key(url), feed, settings.PAGE_CACHE_TIMEOUT)
+
+
+def invalidate_feeds():
+	_bump_version(FEED_VERSION_KEY)
+
+
+def diff_cache_key(old_id, new_id):
+	return 'content:diff:%s:%s' % (old_id, new_id)
+
+
+def get_cached_diff(old_id, new_id):
+	return cache.get(diff_cache_key(old_id, new_id))
+
+
+def set_cached_diff(old_id, new_id, diff):
+	# History revisions never change, so neither does the diff between them.
+	cache.set(diff_cache_key(old_id, new_id), diff, DIFF_CACHE_TIMEOUT)
+
+
+def responsive_cache_key(html, signature):
+	# signature changes with the images html shows, see responsive.py.
+	return 'content:responsive:%s:%s' % (signature, md5(html.encode('utf-8')).hexdigest())
+
+
+def get_cached_responsive(html, signature):
+	return cache.get(responsive_cache_key(html, signature))
+
+
+def set_cached_responsive(html, signature, result):
+	cache.set(responsive_cache_key(html, signature), result, settings.PAGE_CACHE_TIMEOUT)
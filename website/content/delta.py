@@ -0,0 +1,32 @@
+from difflib import SequenceMatcher
+import json
+
+# Every this many revisions one is stored in full. The ones in between are
+# stored as changes against the revision before them.
+SNAPSHOT_INTERVAL = 10
+
+
+def make_delta(base, text):
+	# A delta is a list of [start, end] ranges of lines to copy from base and
+	# strings of new text to insert, in order.
+	base_lines = base.splitlines(True)
+	lines = text.splitlines(True)
+	ops = []
+	matcher = SequenceMatcher(None, base_lines, lines, autojunk=False)
+	for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+		if tag == 'equal':
+			ops.append([i1, i2])
+		elif j2 > j1:
+			ops.append(''.join(lines[j1:j2]))
+	return json.dumps(ops, separators=(',', ':'))
+
+
+def apply_delta(base, delta):
+	base_lines = base.splitlines(True)
+	output = []
+	for op in json.loads(delta):
+		if isinstance(op, list):
+			output.extend(base_lines[op[0]:op[1]])
+		else:
+			output.append(op)
+	return ''.join(output)
@@ -0,0 +1,237 @@
+from django.utils.html import escape
+
+# Above these the diff is only narrowed down to the changed part in the
+# middle, which takes linear time whatever the input.
+MAX_LINES = 20000
+MAX_COST = 500
+# Lines longer than this aren't compared character by character.
+MAX_LINE_LENGTH = 400
+MAX_LINE_COST = 50
+CONTEXT_LINES = 4
+
+
+class DiffTooLarge(Exception):
+	pass
+
+
+def _bisect(a, b, a0, a1, b0, b1, max_cost):
+	# Finds the point where a shortest edit script from a[a0:a1] to
+	# b[b0:b1] crosses the middle, searching from both ends at once so it
+	# only needs space for one row of diagonals (Myers, 1986).
+	n = a1 - a0
+	m = b1 - b0
+	delta = n - m
+	odd = delta % 2 != 0
+	max_d = (n + m + 1) // 2
+	offset = max_d + 1
+	forward = [0] * (2 * offset + 1)
+	backward = [0] * (2 * offset + 1)
+
+	for d in range(max_d + 1):
+		if d > max_cost:
+			raise DiffTooLarge
+		for k in range(-d, d + 1, 2):
+			if k == -d or (k != d and forward[offset + k - 1] < forward[offset + k + 1]):
+				x = forward[offset + k + 1]
+			else:
+				x = forward[offset + k - 1] + 1
+			y = x - k
+			while x < n and y < m and a[a0 + x] == b[b0 + y]:
+				x += 1
+				y += 1
+			forward[offset + k] = x
+			reverse_k = delta - k
+			if odd and -(d - 1) <= reverse_k <= d - 1 and x + backward[offset + reverse_k] >= n:
+				return a0 + x, b0 + y
+
+		for k in range(-d, d + 1, 2):
+			if k == -d or (k != d and backward[offset + k - 1] < backward[offset + k + 1]):
+				x = backward[offset + k + 1]
+			else:
+				x = backward[offset + k - 1] + 1
+			y = x - k
+			while x < n and y < m and a[a1 - 1 - x] == b[b1 - 1 - y]:
+				x += 1
+				y += 1
+			backward[offset + k] = x
+			forward_k = delta - k
+			if not odd and -d <= forward_k <= d and forward[offset + forward_k] + x >= n:
+				return a1 - x, b1 - y
+
+	# Not reached: every pair of sequences has an edit script of length n + m.
+	raise DiffTooLarge
+
+
+def get_matching_blocks(a, b, max_cost=MAX_COST):
+	# Returns (i, j, size) triples for runs where a[i:i + size] == b[j:j + size],
+	# in order.
+	blocks = []
+	todo = [(0, len(a), 0, len(b))]
+	while todo:
+		a0, a1, b0, b1 = todo.pop()
+		start = a0
+		while a0 < a1 and b0 < b1 and a[a0] == b[b0]:
+			a0 += 1
+			b0 += 1
+		if a0 > start:
+			blocks.append((start, b0 - (a0 - start), a0 - start))
+		end = a1
+		while a0 < a1 and b0 < b1 and a[a1 - 1] == b[b1 - 1]:
+			a1 -= 1
+			b1 -= 1
+		if a1 < end:
+			blocks.append((a1, b1, end - a1))
+		if a0 == a1 or b0 == b1:
+			continue
+
+		x, y = _bisect(a, b, a0, a1, b0, b1, max_cost)
+		if (x, y) == (a0, b0) or (x, y) == (a1, b1):
+			continue
+		todo.append((x, a1, y, b1))
+		todo.append((a0, x, b0, y))
+
+	blocks.sort()
+	return blocks
+
+
+def get_opcodes(a, b, max_cost=MAX_COST):
+	# Same as difflib.SequenceMatcher.get_opcodes().
+	opcodes = []
+	i = j = 0
+	for ai, bj, size in get_matching_blocks(a, b, max_cost) + [(len(a), len(b), 0)]:
+		if i < ai and j < bj:
+			opcodes.append(('replace', i, ai, j, bj))
+		elif i < ai:
+			opcodes.append(('delete', i, ai, j, bj))
+		elif j < bj:
+			opcodes.append(('insert', i, ai, j, bj))
+		if size:
+			opcodes.append(('equal', ai, ai + size, bj, bj + size))
+		i, j = ai + size, bj + size
+	return opcodes
+
+
+def _get_rough_opcodes(a, b):
+	# Only strips what's the same at both ends and calls the rest replaced.
+	start = 0
+	while start < len(a) and start < len(b) and a[start] == b[start]:
+		start += 1
+	end = 0
+	while end < len(a) - start and end < len(b) - start and a[-1 - end] == b[-1 - end]:
+		end += 1
+	opcodes = []
+	if start:
+		opcodes.append(('equal', 0, start, 0, start))
+	if start < len(a) - end or start < len(b) - end:
+		opcodes.append(('replace', start, len(a) - end, start, len(b) - end))
+	if end:
+		opcodes.append(('equal', len(a) - end, len(a), len(b) - end, len(b)))
+	return opcodes
+
+
+def _mark_changes(old, new, rough=False):
+	if rough or len(old) > MAX_LINE_LENGTH or len(new) > MAX_LINE_LENGTH:
+		return '<span class="diff_chg">%s</span>' % escape(old), \
+			'<span class="diff_chg">%s</span>' % escape(new)
+	try:
+		opcodes = get_opcodes(old, new, MAX_LINE_COST)
+	except DiffTooLarge:
+		opcodes = _get_rough_opcodes(old, new)
+
+	old_parts = []
+	new_parts = []
+	for tag, i1, i2, j1, j2 in opcodes:
+		old_text = escape(old[i1:i2])
+		new_text = escape(new[j1:j2])
+		if tag == 'equal':
+			old_parts.append(old_text)
+			new_parts.append(new_text)
+		elif tag == 'replace':
+			old_parts.append('<span class="diff_chg">%s</span>' % old_text)
+			new_parts.append('<span class="diff_chg">%s</span>' % new_text)
+		elif tag == 'delete':
+			old_parts.append('<span class="diff_sub">%s</span>' % old_text)
+		else:
+			new_parts.append('<span class="diff_add">%s</span>' % new_text)
+	return ''.join(old_parts), ''.join(new_parts)
+
+
+def _row(old_number, old_text, new_number, new_text):
+	# The same six cells as difflib.HtmlDiff makes, which the history
+	# template's styles expect.
+	return '<tr><td></td><td>%s</td><td>%s</td><td></td><td>%s</td><td>%s</td></tr>' % (
+		old_number or '', old_text, new_number or '', new_text
+	)
+
+
+def _rows(a, b, opcode, rough):
+	tag, i1, i2, j1, j2 = opcode
+	if tag == 'equal':
+		for i, j in zip(range(i1, i2), range(j1, j2)):
+			yield _row(i + 1, escape(a[i]), j + 1, escape(b[j]))
+		return
+
+	paired = min(i2 - i1, j2 - j1)
+	for n in range(paired):
+		old_text, new_text = _mark_changes(a[i1 + n], b[j1 + n], rough)
+		yield _row(i1 + n + 1, old_text, j1 + n + 1, new_text)
+	for i in range(i1 + paired, i2):
+		yield _row(i + 1, '<span class="diff_sub">%s</span>' % escape(a[i]), None, '')
+	for j in range(j1 + paired, j2):
+		yield _row(None, '', j + 1, '<span class="diff_add">%s</span>' % escape(b[j]))
+
+
+def _group_opcodes(opcodes, context):
+	# Splits the opcodes into hunks with at most context unchanged lines
+	# around each change.
+	if not opcodes:
+		return []
+	if opcodes[0][0] == 'equal':
+		tag, i1, i2, j1, j2 = opcodes[0]
+		opcodes[0] = tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2
+	if opcodes[-1][0] == 'equal':
+		tag, i1, i2, j1, j2 = opcodes[-1]
+		opcodes[-1] = tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)
+
+	groups = []
+	group = []
+	for tag, i1, i2, j1, j2 in opcodes:
+		if tag == 'equal' and i2 - i1 > context * 2:
+			group.append((tag, i1, i1 + context, j1, j1 + context))
+			groups.append(group)
+			group = []
+			i1, j1 = i2 - context, j2 - context
+		group.append((tag, i1, i2, j1, j2))
+	if group and not (len(group) == 1 and group[0][0] == 'equal'):
+		groups.append(group)
+	return groups
+
+
+def make_table(old, new, context=CONTEXT_LINES):
+	# Returns an HTML table with the changed lines of old and new side by
+	# side, like difflib.HtmlDiff.make_table(context=True).
+	a = old.splitlines()
+	b = new.splitlines()
+	rough = len(a) > MAX_LINES or len(b) > MAX_LINES
+	if rough:
+		opcodes = _get_rough_opcodes(a, b)
+	else:
+		# Compare numbers rather than strings.
+		ids = {}
+		a_ids = [ids.setdefault(line, len(ids)) for line in a]
+		b_ids = [ids.setdefault(line, len(ids)) for line in b]
+		try:
+			opcodes = get_opcodes(a_ids, b_ids)
+		except DiffTooLarge:
+			rough = True
+			opcodes = _get_rough_opcodes(a_ids, b_ids)
+
+	groups = _group_opcodes([o for o in opcodes if o[1] < o[2] or o[3] < o[4]], context)
+	if not groups:
+		body = '<tbody>%s</tbody>' % _row(None, 'No Differences Found', None, 'No Differences Found')
+	else:
+		body = ''.join(
+			'<tbody>%s</tbody>' % ''.join(row for opcode in group for row in _rows(a, b, opcode, rough))
+			for group in groups
+		)
+	return '<table class="diff">%s</table>' % body
@@ -0,0 +1,163 @@
+import os
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.urlresolvers import resolve, reverse, NoReverseMatch
+from django.http import Http404, HttpResponseNotFound
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from content.models import BlogEntry, ContentChange, Page
+from content.pagination import make_cursor
+from content.views import BLOG_ENTRIES_PER_PAGE
+
+WATERMARK_NAME = '.export-watermark'
+
+
+def get_page_urls():
+	return [p.get_absolute_url() for p in Page.objects.filter(status='P').only('path')]
+
+
+def get_blog_urls():
+	urls = []
+	lists = {reverse('blog_list'): []}
+
+	def add_to_list(entry, **kwargs):
+		try:
+			url = reverse('blog_list', kwargs=kwargs)
+		except NoReverseMatch:
+			# Tags with characters our URLs don't accept can't be linked to anyway.
+			return
+		lists.setdefault(url, []).append(entry)
+
+	entries = BlogEntry.objects.filter(status='P').order_by('-created', '-pk')
+	for entry in entries.prefetch_related('tag_set'):
+		urls.append(entry.get_absolute_url())
+		lists[reverse('blog_list')].append(entry)
+		add_to_list(entry, year=entry.created.strftime('%Y'))
+		add_to_list(entry, date=entry.dateslug())
+		for tag in entry.tag_set.all():
+			add_to_list(entry, tag=tag.name)
+
+	for url, entry_list in sorted(lists.items()):
+		urls.append(url)
+		# Each page after the first starts after the last entry of the one before.
+		for i in range(BLOG_ENTRIES_PER_PAGE, len(entry_list), BLOG_ENTRIES_PER_PAGE):
+			urls.append('%s?before=%s' % (url, make_cursor(entry_list[i - 1])))
+		urls.append(url + '?atom')
+
+	return urls
+
+
+def get_site_urls():
+	return get_page_urls() + get_blog_urls()
+
+
+def get_changed_urls(since, until):
+	# Returns the URLs affected by changes since the last export, or None if
+	# the whole site needs exporting again.
+	first = ContentChange.objects.order_by('pk').values_list('pk', flat=True).first()
+	if first is not None and first > since + 1:
+		# Changes this export hasn't seen were pruned after an export elsewhere.
+		return None
+
+	urls = set()
+	page_ids = []
+	blog_changed = False
+	for change in ContentChange.objects.filter(pk__gt=since, pk__lte=until).iterator():
+		if change.kind == 'M' or (change.kind == 'L' and change.path.startswith('template/')):
+			# Templates can include or extend each other, so we can't tell
+			# which pages use them.
+			return None
+		elif change.kind == 'P':
+			urls.add(change.path)
+			page_ids.append(change.object_id)
+		elif change.kind == 'B':
+			urls.add(change.path)
+			blog_changed = True
+
+	for i in range(0, len(page_ids), 500):
+		urls.update(
+			Page.objects.filter(pk__in=page_ids[i:i + 500]).values_list('path', flat=True)
+		)
+	if blog_changed:
+		# Adding or removing an entry moves everything after it on to a
+		# different page of each list, so redo them all.
+		urls.update(get_blog_urls())
+
+	urls.discard('')
+	return sorted(urls)
+
+
+def prune_changes(until):
+	# The change at until is kept, so that get_changed_urls can tell which
+	# exports still needed the ones removed.
+	ContentChange.objects.filter(pk__lt=until).delete()
+
+
+def read_watermark(output):
+	try:
+		with open(os.path.join(output, WATERMARK_NAME)) as f:
+			return int(f.read())
+	except (IOError, ValueError):
+		return None
+
+
+def write_watermark(output, change_id):
+	with open(os.path.join(output, WATERMARK_NAME), 'w') as f:
+		f.write('%d' % change_id)
+
+
+def get_output_name(url, content_type):
+	# The query string becomes part of the name, so /news?page=2 is written to
+	# news.page-2.html and /news?atom to news.atom.xml.
+	path, _, query = url.partition('?')
+	name = path.strip('/') or 'index'
+	if name == 'index' and path.strip('/'):
+		raise ValueError('%s would be written over the home page, as index.html.' % url)
+	if query:
+		for part in query.split('&'):
+			name += '.' + part.replace('=', '-')
+	if content_type.startswith('application/atom+xml'):
+		return name + '.xml'
+	return name + '.html'
+
+
+def render_url(url, host, secure=False):
+	request = RequestFactory().get(url, HTTP_HOST=host, secure=secure)
+	request.user = AnonymousUser()
+	match = resolve(request.path)
+	# The host was given on the command line, so it can be trusted even if
+	# it's not one the site is served from.
+	with override_settings(ALLOWED_HOSTS=[host.split(':')[0]]):
+		try:
+			return match.func(request, *match.args, **match.kwargs)
+		except Http404:
+			return HttpResponseNotFound()
+
+
+def remove_url(output, url):
+	for content_type in ('text/html', 'application/atom+xml'):
+		path = os.path.join(output, get_output_name(url, content_type))
+		if os.path.exists(path):
+			os.unlink(path)
+
+
+def export_url(args):
+	url, output, host, secure = args
+	response = render_url(url, host, secure)
+	if response.status_code != 200:
+		# The page has gone or moved, so don't leave an old copy behind.
+		remove_url(output, url)
+		return url, response.status_code
+
+	path = os.path.join(output, get_output_name(url, response['Content-Type']))
+	try:
+		os.makedirs(os.path.dirname(path))
+	except OSError:
+		pass
+
+	# Write to a temporary file first so the web server never sees half a page.
+	with open(path + '.tmp', 'wb') as f:
+		f.write(response.content)
+	os.rename(path + '.tmp', path)
+	return url, response.status_code
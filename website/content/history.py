@@ -0,0 +1,118 @@
+from datetime import timedelta
+
+from django.db import transaction
+
+from content.delta import SNAPSHOT_INTERVAL, apply_delta, make_delta
+from content.models import PageHistory
+
+
+def get_kept_revisions(revisions, pinned, now, keep_days, daily_days):
+	# revisions are the history of one page, oldest first. All of the recent
+	# ones are kept, then the last one of each day, then the last one of each
+	# week. pinned revisions are always kept.
+	kept = set(pinned)
+	if revisions:
+		# The newest is what the page looks like now.
+		kept.add(revisions[-1].pk)
+
+	buckets = {}
+	for revision in revisions:
+		age = now - revision.modified
+		if age < timedelta(days=keep_days):
+			kept.add(revision.pk)
+			continue
+		if age < timedelta(days=keep_days + daily_days):
+			bucket = ('day', revision.modified.date())
+		else:
+			bucket = ('week', revision.modified.isocalendar()[:2])
+		buckets[bucket] = revision.pk
+	kept.update(buckets.values())
+	return kept
+
+
+def get_pinned_revisions(revisions, others):
+	# Drafts and future revisions were started from whatever the page was when
+	# they were made, so keep that to compare them against.
+	pinned = set()
+	i = 0
+	for other in sorted(others):
+		while i < len(revisions) and revisions[i].pk < other:
+			i += 1
+		if i > 0:
+			pinned.add(revisions[i - 1].pk)
+	return pinned
+
+
+def compact_page_history(page_id, now, keep_days, daily_days, dry_run=False):
+	# Returns how many revisions there were and how many were removed.
+	with transaction.atomic():
+		revisions = list(PageHistory.objects.filter(page_id=page_id, type='H').order_by('pk'))
+		others = PageHistory.objects.filter(page_id=page_id).exclude(type='H')
+		pinned = get_pinned_revisions(revisions, others.values_list('pk', flat=True))
+		kept = get_kept_revisions(revisions, pinned, now, keep_days, daily_days)
+		removed = [r.pk for r in revisions if r.pk not in kept]
+		if dry_run or not removed:
+			return len(revisions), len(removed)
+
+		texts = {}
+		for revision in revisions:
+			texts[revision.pk] = dict(
+				(name, getattr(revision, 'stored_' + name)) for name in PageHistory.delta_fields
+			)
+			if revision.base_id is not None:
+				for name, stored in texts[revision.pk].items():
+					texts[revision.pk][name] = apply_delta(texts[revision.base_id][name], stored)
+
+		# Store what's left against each other before removing the rest, which
+		# would take anything stored against them along.
+		previous = None
+		for revision in revisions:
+			if revision.pk not in kept:
+				continue
+			if previous is None or previous.chain_length + 1 >= SNAPSHOT_INTERVAL:
+				base, chain_length = None, 0
+			else:
+				base, chain_length = previous, previous.chain_length + 1
+			if base is not None or revision.base_id is not None:
+				update = {}
+				for name in PageHistory.delta_fields:
+					text = texts[revision.pk][name]
+					if base is not None:
+						text = make_delta(texts[base.pk][name], text)
+					update['stored_' + name] = text
+				PageHistory.objects.filter(pk=revision.pk).update(
+					base=base, chain_length=chain_length, **update
+				)
+			revision.chain_length = chain_length
+			previous = revision
+
+		PageHistory.objects.filter(pk__in=removed).delete()
+		return len(revisions), len(removed)
+
+
+def get_next_scheduled():
+	return PageHistory.objects.filter(type='F').order_by('modified').values_list(
+		'modified', flat=True
+	).first()
+
+
+def publish_due_revisions(now, batch_size=100):
+	# Publishes future revisions that are due, oldest first so that the latest
+	# one for a page wins. Returns how many were published.
+	published = 0
+	while True:
+		due = list(
+			PageHistory.objects.filter(type='F', modified__lte=now)
+			.order_by('modified', 'pk').values_list('pk', flat=True)[:batch_size]
+		)
+		for pk in due:
+			with transaction.atomic():
+				# Someone else may have published or changed it in the meantime.
+				revision = PageHistory.objects.select_for_update().filter(
+					pk=pk, type='F', modified__lte=now
+				).select_related('page', 'modifier').first()
+				if revision is not None:
+					revision.make_current(revision.modifier)
+					published += 1
+		if len(due) < batch_size:
+			return published
@@ -0,0 +1,208 @@
+import os
+
+from django.db import connection, transaction
+from django.db.models import F
+from easy_thumbnails.alias import aliases
+from easy_thumbnails.files import get_thumbnailer
+from PIL import Image
+
+from content.models import MediaImage
+from website import settings
+
+try:
+	from os import scandir
+except ImportError:
+	# Python 2 has no scandir, so walk stats each entry itself.
+	scandir = None
+
+IMAGES_DIR = 'images'
+
+
+def is_svg(path):
+	return path[-4:].lower() == '.svg'
+
+
+def get_variant_width(alias):
+	# The width of the variant an alias makes, or None if it's a thumbnail.
+	if alias.startswith('w') and alias[1:].isdigit():
+		return int(alias[1:])
+	return None
+
+
+def get_alias_thumbnailer(path, alias):
+	thumbnailer = get_thumbnailer(path)
+	if get_variant_width(alias) is not None:
+		thumbnailer.thumbnail_extension = settings.IMAGE_VARIANT_FORMAT
+		thumbnailer.thumbnail_transparency_extension = settings.IMAGE_VARIANT_FORMAT
+	return thumbnailer
+
+
+def walk(directory):
+	# Yields (path relative to MEDIA_ROOT, size, mtime) for every file below
+	# directory, without following symlinks to directories.
+	todo = [directory]
+	while todo:
+		directory = todo.pop()
+		if scandir is not None:
+			for entry in scandir(directory):
+				if entry.is_dir(follow_symlinks=False):
+					todo.append(entry.path)
+				elif entry.is_file():
+					stat = entry.stat()
+					yield os.path.relpath(entry.path, settings.MEDIA_ROOT), stat.st_size, stat.st_mtime
+		else:
+			for name in os.listdir(directory):
+				path = os.path.join(directory, name)
+				if os.path.isdir(path) and not os.path.islink(path):
+					todo.append(path)
+				elif os.path.isfile(path):
+					stat = os.stat(path)
+					yield os.path.relpath(path, settings.MEDIA_ROOT), stat.st_size, stat.st_mtime
+
+
+def _get_dimensions(path):
+	try:
+		# Only reads as far as the header.
+		with open(os.path.join(settings.MEDIA_ROOT, path), 'rb') as f:
+			return Image.open(f).size
+	except (IOError, SyntaxError, ValueError):
+		return None, None
+
+
+def _get_existing_thumbnails(path):
+	thumbnails = {}
+	for alias, options in aliases.all(target=path).items():
+		existing = get_alias_thumbnailer(path, alias).get_existing_thumbnail(options)
+		if existing is not None:
+			thumbnails[alias] = existing.name
+	return thumbnails
+
+
+def _fill(image, size, mtime):
+	image.size = size
+	image.mtime = mtime
+	if is_svg(image.path):
+		image.width = image.height = None
+		image.set_thumbnails({})
+	else:
+		image.width, image.height = _get_dimensions(image.path)
+		image.set_thumbnails(_get_existing_thumbnails(image.path))
+
+
+def index_image(path):
+	# path is relative to MEDIA_ROOT, e.g. images/photo.jpg.
+	stat = os.stat(os.path.join(settings.MEDIA_ROOT, path))
+	image = MediaImage.objects.filter(path=path).first() or MediaImage(path=path)
+	if image.pk is None or (image.size, image.mtime) != (stat.st_size, stat.st_mtime):
+		_fill(image, stat.st_size, stat.st_mtime)
+		image.save()
+	return image
+
+
+def remove_images(paths):
+	paths = list(paths)
+	for i in range(0, len(paths), 500):
+		MediaImage.objects.filter(path__in=paths[i:i + 500]).delete()
+
+
+def move_image(old_path, new_path, renamed=None):
+	# renamed maps the old names of the thumbnails that moved along with the
+	# image to their new names. The rest are forgotten.
+	if old_path == new_path:
+		index_image(new_path)
+		return
+	MediaImage.objects.filter(path=new_path).delete()
+	image = MediaImage.objects.filter(path=old_path).first()
+	if image is None:
+		index_image(new_path)
+		return
+	renamed = renamed or {}
+	image.path = new_path
+	image.set_thumbnails(dict(
+		(alias, renamed[name]) for alias, name in image.get_thumbnails().items() if name in renamed
+	))
+	image.save()
+
+
+def rescan():
+	# Brings the index in line with the disk. Returns how many images were
+	# added, updated and removed.
+	indexed = dict(
+		(path, (size, mtime))
+		for path, size, mtime in MediaImage.objects.values_list('path', 'size', 'mtime').iterator()
+	)
+	added = []
+	updated = 0
+	for path, size, mtime in walk(os.path.join(settings.MEDIA_ROOT, IMAGES_DIR)):
+		old = indexed.pop(path, None)
+		if old == (size, mtime):
+			continue
+		if old is None:
+			image = MediaImage(path=path)
+			_fill(image, size, mtime)
+			added.append(image)
+		else:
+			image = MediaImage.objects.get(path=path)
+			_fill(image, size, mtime)
+			image.save()
+			updated += 1
+	MediaImage.objects.bulk_create(added, batch_size=500)
+	remove_images(indexed)
+	return len(added), updated, len(indexed)
+
+
+def get_image_tree():
+	# The folders and images for the image picker, from the index.
+	root = {'path': '.', 'images': [], 'folders': []}
+	folders = {'': root}
+
+	def get_folder(name):
+		if name not in folders:
+			folders[name] = {'path': name, 'images': [], 'folders': []}
+			get_folder(os.path.dirname(name))['folders'].append(folders[name])
+		return folders[name]
+
+	for image in MediaImage.objects.order_by('path').iterator():
+		url = os.path.join(settings.MEDIA_URL, image.path)
+		item = {'url': url}
+		if is_svg(image.path):
+			item['thumb'] = url
+		else:
+			thumbnail = image.get_thumbnails().get('smallthumb')
+			if thumbnail is not None:
+				item['thumb'] = os.path.join(settings.MEDIA_URL, thumbnail)
+			if image.width is not None:
+				item['width'] = image.width
+				item['height'] = image.height
+		folder = os.path.dirname(os.path.relpath(image.path, IMAGES_DIR))
+		get_folder(folder)['images'].append(item)
+
+	for folder in folders.values():
+		folder['images'].sort(key=lambda x: x['url'].lower())
+		folder['folders'].sort(key=lambda x: x['path'].lower())
+	return root
+
+
+def lock_image(path):
+	# Returns the image at path, locked until the end of the transaction.
+	# select_for_update does nothing on SQLite, where a transaction that reads
+	# and then writes fails rather than waits if another is writing, so write
+	# first there.
+	image = MediaImage.objects.filter(path=path)
+	if connection.vendor == 'sqlite':
+		image.update(pending=F('pending'))
+	return image.select_for_update().first()
+
+
+def record_thumbnail(path, alias, name):
+	# Other processes may be recording other thumbnails of the same image.
+	with transaction.atomic():
+		image = lock_image(path)
+		if image is None:
+			return
+		thumbnails = image.get_thumbnails()
+		if thumbnails.get(alias) == name:
+			return
+		thumbnails[alias] = name
+		image.set_thumbnails(thumbnails)
+		image.save(update_fields=['thumbnails'])
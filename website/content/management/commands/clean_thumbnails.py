@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from easy_thumbnails.conf import settings as thumbnail_settings
+
+from content.thumbnails import collect_garbage
+
+
+class Command(BaseCommand):
+	help = 'Removes thumbnails, and their database rows, whose images are gone.'
+
+	def add_arguments(self, parser):
+		parser.add_argument(
+			'--dry-run', action='store_true', help='Only count what would be removed.'
+		)
+
+	def handle(self, *args, **options):
+		if not thumbnail_settings.THUMBNAIL_BASEDIR:
+			# Thumbnails would be mixed in with everything else.
+			raise CommandError('THUMBNAIL_BASEDIR must be set.')
+		files, rows = collect_garbage(options['dry_run'])
+		if options['dry_run']:
+			self.stdout.write('%d files and %d database rows would be removed.' % (files, rows))
+		else:
+			self.stdout.write('%d files and %d database rows removed.' % (files, rows))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from content.history import compact_page_history
+from content.models import PageHistory
+
+
+class Command(BaseCommand):
+	help = 'Thins out old page history, keeping fewer revisions the older they get.'
+
+	def add_arguments(self, parser):
+		parser.add_argument(
+			'--keep-days', type=int, default=30,
+			help='Keep every revision from this many days back (default: 30).'
+		)
+		parser.add_argument(
+			'--daily-days', type=int, default=365,
+			help='Before that, keep the last revision of each day for this many days '
+			'(default: 365). Older than that, keep the last revision of each week.'
+		)
+		parser.add_argument(
+			'--dry-run', action='store_true', help='Only count what would be removed.'
+		)
+
+	def handle(self, *args, **options):
+		start = now()
+		page_ids = PageHistory.objects.filter(type='H').order_by('page_id').values_list(
+			'page_id', flat=True
+		).distinct()
+
+		total = removed = 0
+		# One short transaction per page, so editors aren't kept waiting.
+		for page_id in list(page_ids):
+			page_total, page_removed = compact_page_history(
+				page_id, start, options['keep_days'], options['daily_days'], options['dry_run']
+			)
+			total += page_total
+			removed += page_removed
+
+		if options['dry_run']:
+			self.stdout.write('%d of %d revisions would be removed.' % (removed, total))
+		else:
+			self.stdout.write('%d of %d revisions removed.' % (removed, total))
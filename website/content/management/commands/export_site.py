@@ -0,0 +1,82 @@
+from multiprocessing import Pool, cpu_count
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Max
+
+from content.export import (
+	export_url, get_changed_urls, get_output_name, get_site_urls, prune_changes, read_watermark,
+	write_watermark
+)
+from content.models import ContentChange
+
+
+class Command(BaseCommand):
+	help = 'Renders all published pages, blog entries, lists and feeds to static files.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('output', help='Directory to write the files to.')
+		parser.add_argument(
+			'--incremental', action='store_true',
+			help='Only render what has changed since the last export to this directory.'
+		)
+		parser.add_argument(
+			'--jobs', type=int, default=cpu_count(),
+			help='Number of processes to render with (default: one per CPU).'
+		)
+		parser.add_argument(
+			'--host', default='localhost', help='Host name to use in absolute links.'
+		)
+		parser.add_argument('--https', action='store_true', help='Use https in absolute links.')
+
+	def handle(self, *args, **options):
+		output = options['output']
+		# Anything changed after this point will be picked up next time.
+		until = ContentChange.objects.aggregate(Max('pk'))['pk__max'] or 0
+
+		urls = None
+		if options['incremental']:
+			since = read_watermark(output)
+			if since is not None:
+				urls = get_changed_urls(since, until)
+		incremental = urls is not None
+		if urls is None:
+			urls = get_site_urls()
+
+		for url in urls:
+			try:
+				get_output_name(url, 'text/html')
+			except ValueError as e:
+				raise CommandError(e)
+
+		self.export(urls, options, incremental)
+		write_watermark(output, until)
+		if options['incremental']:
+			prune_changes(until)
+
+	def export(self, urls, options, incremental=False):
+		tasks = [(url, options['output'], options['host'], options['https']) for url in urls]
+
+		if options['jobs'] > 1 and len(tasks) > 1:
+			# Each process needs its own database connection.
+			connections.close_all()
+			pool = Pool(options['jobs'])
+			try:
+				results = list(pool.imap_unordered(export_url, tasks, chunksize=16))
+			finally:
+				pool.close()
+				pool.join()
+		else:
+			results = [export_url(t) for t in tasks]
+
+		exported = 0
+		for url, status in sorted(results):
+			if status == 200:
+				exported += 1
+			elif incremental:
+				# It was exported before, and export_url removed the old copy.
+				self.stderr.write('%s returned %d, removed.' % (url, status))
+			else:
+				self.stderr.write('%s returned %d, skipped.' % (url, status))
+		self.stdout.write('%d of %d files exported.' % (exported, len(urls)))
+		return results
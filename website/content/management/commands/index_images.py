@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from content.images import rescan
+
+
+class Command(BaseCommand):
+	help = 'Updates the image index with any changes made to the images folder outside the admin.'
+
+	def handle(self, *args, **options):
+		added, updated, removed = rescan()
+		self.stdout.write('%d images added, %d updated and %d removed.' % (added, updated, removed))
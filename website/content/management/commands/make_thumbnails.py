@@ -0,0 +1,65 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from content import thumbnails
+from website import settings
+
+
+class Command(BaseCommand):
+	help = 'Makes the thumbnails of uploaded images, which the file browser leaves to it.'
+
+	def add_arguments(self, parser):
+		parser.add_argument(
+			'--once', action='store_true',
+			help='Make what is waiting and exit, for running from cron.'
+		)
+		parser.add_argument(
+			'--interval', type=int, default=5,
+			help='Seconds to wait before checking again (default: 5).'
+		)
+		parser.add_argument(
+			'--jobs', type=int, default=settings.THUMBNAIL_WORKERS,
+			help='How many images to work on at once (default: THUMBNAIL_WORKERS, or one per CPU). '
+			'0 works in this process.'
+		)
+		parser.add_argument(
+			'--memory-limit', type=int, default=0,
+			help='Most memory each job can use, in megabytes. Images that need more fail. '
+			'Ignored with --jobs 0.'
+		)
+		parser.add_argument(
+			'--timeout', type=int, default=thumbnails.JOB_TIMEOUT,
+			help='Most seconds each job can take. Images that take longer fail (default: %d). '
+			'Ignored with --jobs 0.' % thumbnails.JOB_TIMEOUT
+		)
+		parser.add_argument(
+			'--batch-size', type=int, default=100,
+			help='Number of images to fetch at a time (default: 100).'
+		)
+
+	def handle(self, *args, **options):
+		while True:
+			done = failed = 0
+			while True:
+				# A claim outlasts a job, so it isn't taken from under a job
+				# that's still running.
+				paths = thumbnails.take_pending(options['batch_size'], options['timeout'] * 2)
+				if not paths:
+					break
+				for i, (path, error) in enumerate(thumbnails.generate_all(
+					paths, options['jobs'], options['memory_limit'], options['timeout']
+				)):
+					thumbnails.finish_pending(path, paths[i + 1:])
+					if error is not None:
+						failed += 1
+						self.stderr.write('%s: %s' % (path, error))
+				done += len(paths)
+			if done or options['verbosity'] > 1:
+				self.stdout.write('%d images done, %d failed.' % (done - failed, failed))
+			if options['once']:
+				return
+
+			connections.close_all()
+			time.sleep(options['interval'])
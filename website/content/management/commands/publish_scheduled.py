@@ -0,0 +1,44 @@
+from datetime import timedelta
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils.timezone import now
+
+from content.history import get_next_scheduled, publish_due_revisions
+
+
+class Command(BaseCommand):
+	help = 'Publishes future page revisions when they are due.'
+
+	def add_arguments(self, parser):
+		parser.add_argument(
+			'--once', action='store_true',
+			help='Publish what is due and exit, for running from cron.'
+		)
+		parser.add_argument(
+			'--interval', type=int, default=60,
+			help='Most seconds to wait before checking again (default: 60).'
+		)
+		parser.add_argument(
+			'--batch-size', type=int, default=100,
+			help='Number of revisions to fetch at a time (default: 100).'
+		)
+
+	def handle(self, *args, **options):
+		while True:
+			start = now()
+			published = publish_due_revisions(start, options['batch_size'])
+			if published or options['verbosity'] > 1:
+				self.stdout.write('%d revisions published.' % published)
+			if options['once']:
+				return
+
+			# Sleep until the next one is due, but check now and then for
+			# ones scheduled in the meantime.
+			wait = timedelta(seconds=options['interval'])
+			next_scheduled = get_next_scheduled()
+			if next_scheduled is not None:
+				wait = max(timedelta(), min(wait, next_scheduled - now()))
+			connection.close()
+			time.sleep(wait.total_seconds())
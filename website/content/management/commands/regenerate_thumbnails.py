@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+
+from content import images, thumbnails
+from content.models import MediaImage
+from website import settings
+
+
+class Command(BaseCommand):
+	help = (
+		'Makes the thumbnails that are missing or were made for different THUMBNAIL_ALIASES. '
+		'What\'s done is recorded as it goes, so running it again picks up where it left off.'
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument(
+			'--jobs', type=int, default=settings.THUMBNAIL_WORKERS,
+			help='How many images to work on at once (default: THUMBNAIL_WORKERS, or one per CPU). '
+			'0 works in this process.'
+		)
+		parser.add_argument(
+			'--memory-limit', type=int, default=0,
+			help='Most memory each job can use, in megabytes. Images that need more fail. '
+			'Ignored with --jobs 0.'
+		)
+		parser.add_argument(
+			'--timeout', type=int, default=thumbnails.JOB_TIMEOUT,
+			help='Most seconds each job can take. Images that take longer fail (default: %d). '
+			'Ignored with --jobs 0.' % thumbnails.JOB_TIMEOUT
+		)
+		parser.add_argument(
+			'--dry-run', action='store_true', help='Only count the images that need thumbnails.'
+		)
+
+	def handle(self, *args, **options):
+		images.rescan()
+		todo = []
+		for image in MediaImage.objects.order_by('pk').iterator():
+			if images.is_svg(image.path):
+				continue
+			if not options['dry_run']:
+				thumbnails.forget_stale(image)
+			elif thumbnails.get_stale_aliases(image):
+				todo.append(image.path)
+				continue
+			if thumbnails.get_missing_aliases(image):
+				todo.append(image.path)
+
+		if options['dry_run']:
+			self.stdout.write('%d images need thumbnails.' % len(todo))
+			return
+
+		failed = 0
+		for path, error in thumbnails.generate_all(
+			todo, options['jobs'], options['memory_limit'], options['timeout']
+		):
+			if error is not None:
+				failed += 1
+				self.stderr.write('%s: %s' % (path, error))
+		self.stdout.write('%d images done, %d failed.' % (len(todo) - failed, failed))
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2026-10-18 09:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def join_path(parent_path, alias):
+    if alias == 'home':
+        return parent_path or '/'
+    return (parent_path or '').rstrip('/') + '/' + alias
+
+
+def set_paths(apps, schema_editor):
+    Page = apps.get_model('content', 'Page')
+    paths = {}
+    for page in Page.objects.order_by('tree_id', 'lft'):
+        page.path = join_path(paths.get(page.parent_id), page.alias)
+        paths[page.pk] = page.path
+        page.save(update_fields=['path'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0019_merge_20170321_1243'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='page',
+            name='status',
+            field=models.CharField(choices=[('P', 'Published'), ('D', 'Draft'), ('A', 'Archived')], default='D', max_length=1),
+        ),
+        migrations.AddField(
+            model_name='page',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+            preserve_default=False,
+        ),
+        migrations.RunPython(set_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2026-10-18 17:16
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0021_pageredirect'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContentChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('P', 'Page'), ('B', 'Blog entry'), ('M', 'Menu'), ('L', 'Layout')], max_length=1)),
+                ('object_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('path', models.CharField(blank=True, max_length=255)),
+                ('changed', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2026-10-18 17:18
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_tags(apps, schema_editor):
+    BlogEntry = apps.get_model('content', 'BlogEntry')
+    Tag = apps.get_model('content', 'Tag')
+
+    tags = {}
+    for entry in BlogEntry.objects.all():
+        for name in set(t for t in entry.tags.split(' ') if t):
+            if name not in tags:
+                tags[name] = Tag.objects.create(name=name)
+            entry.tag_set.add(tags[name])
+            if entry.status == 'P':
+                tags[name].entry_count += 1
+
+    for tag in tags.values():
+        tag.save(update_fields=['entry_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0022_contentchange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('entry_count', models.PositiveIntegerField(default=0, editable=False)),
+            ],
+            options={
+                'ordering': ('name',),
+            },
+        ),
+        migrations.AddField(
+            model_name='blogentry',
+            name='tag_set',
+            field=models.ManyToManyField(editable=False, related_name='entries', to='content.Tag'),
+        ),
+        migrations.RunPython(fill_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2026-10-18 17:19
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0023_tag'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='blogentry',
+            index_together=set([('created', 'id')]),
+        ),
+    ]
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2026-10-18 17:21
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.utils import OperationalError
+from django.utils.html import strip_tags
+
+# Copies of the statements in content.search as they were when this migration
+# was written.
+TABLE = 'content_searchdocument'
+FTS_TABLE = TABLE + '_fts'
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE %s USING fts5(title, body, content='%s', content_rowid='id')" % (
+        FTS_TABLE, TABLE
+    ),
+    'CREATE TRIGGER %s_ai AFTER INSERT ON %s BEGIN '
+    'INSERT INTO %s(rowid, title, body) VALUES (new.id, new.title, new.body); END' % (
+        TABLE, TABLE, FTS_TABLE
+    ),
+    'CREATE TRIGGER %s_ad AFTER DELETE ON %s BEGIN '
+    "INSERT INTO %s(%s, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); END" % (
+        TABLE, TABLE, FTS_TABLE, FTS_TABLE
+    ),
+    'CREATE TRIGGER %s_au AFTER UPDATE ON %s BEGIN '
+    "INSERT INTO %s(%s, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); "
+    'INSERT INTO %s(rowid, title, body) VALUES (new.id, new.title, new.body); END' % (
+        TABLE, TABLE, FTS_TABLE, FTS_TABLE, FTS_TABLE
+    ),
+]
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS %s_ai' % TABLE,
+    'DROP TRIGGER IF EXISTS %s_ad' % TABLE,
+    'DROP TRIGGER IF EXISTS %s_au' % TABLE,
+    'DROP TABLE IF EXISTS %s' % FTS_TABLE,
+]
+MYSQL_CREATE = ['ALTER TABLE %s ADD FULLTEXT INDEX %s_fulltext (title, body)' % (TABLE, TABLE)]
+MYSQL_DROP = ['ALTER TABLE %s DROP INDEX %s_fulltext' % (TABLE, TABLE)]
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        try:
+            for sql in SQLITE_CREATE:
+                schema_editor.execute(sql)
+        except OperationalError:
+            # SQLite was built without FTS5, so search falls back to LIKE.
+            for sql in SQLITE_DROP:
+                schema_editor.execute(sql)
+    elif schema_editor.connection.vendor == 'mysql':
+        for sql in MYSQL_CREATE:
+            schema_editor.execute(sql)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in SQLITE_DROP:
+            schema_editor.execute(sql)
+    elif schema_editor.connection.vendor == 'mysql':
+        for sql in MYSQL_DROP:
+            schema_editor.execute(sql)
+
+
+def fill_index(apps, schema_editor):
+    SearchDocument = apps.get_model('content', 'SearchDocument')
+    for kind, model in [('P', 'Page'), ('B', 'BlogEntry')]:
+        for obj in apps.get_model('content', model).objects.all():
+            SearchDocument.objects.create(
+                kind=kind, object_id=obj.pk, title=obj.title, body=strip_tags(obj.content)
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0024_blogentry_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('P', 'Page'), ('B', 'Blog entry')], max_length=1)),
+                ('object_id', models.PositiveIntegerField()),
+                ('title', models.CharField(max_length=255)),
+                ('body', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchdocument',
+            unique_together=set([('kind', 'object_id')]),
+        ),
+        migrations.RunPython(create_index, drop_index),
+        migrations.RunPython(fill_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2026-10-18 18:02
+from __future__ import unicode_literals
+
+from difflib import SequenceMatcher
+import json
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Copies of content.delta as it was when this migration was written.
+SNAPSHOT_INTERVAL = 10
+
+
+def make_delta(base, text):
+    base_lines = base.splitlines(True)
+    lines = text.splitlines(True)
+    ops = []
+    matcher = SequenceMatcher(None, base_lines, lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append(''.join(lines[j1:j2]))
+    return json.dumps(ops, separators=(',', ':'))
+
+
+def apply_delta(base, delta):
+    base_lines = base.splitlines(True)
+    output = []
+    for op in json.loads(delta):
+        if isinstance(op, list):
+            output.extend(base_lines[op[0]:op[1]])
+        else:
+            output.append(op)
+    return ''.join(output)
+
+FIELDS = {
+    'PageHistory': ('page_id', ['content', 'extra_header_content'], {'type': 'H'}),
+    'BlogEntryHistory': ('entry_id', ['content'], {}),
+}
+
+
+def compress_history(apps, schema_editor):
+    for model_name, (owner, names, filters) in FIELDS.items():
+        Model = apps.get_model('content', model_name)
+        revisions = Model.objects.filter(**filters).order_by(owner, 'pk')
+        previous = None
+        for revision in revisions.iterator():
+            if previous is None or getattr(previous, owner) != getattr(revision, owner) or \
+                    previous.chain_length + 1 >= SNAPSHOT_INTERVAL:
+                previous = revision
+                continue
+            revision.chain_length = previous.chain_length + 1
+            update = dict(
+                ('stored_' + name, make_delta(
+                    getattr(previous, 'stored_' + name), getattr(revision, 'stored_' + name)
+                )) for name in names
+            )
+            Model.objects.filter(pk=revision.pk).update(
+                base_id=previous.pk, chain_length=revision.chain_length, **update
+            )
+            # The instance keeps the full text to make the next delta from.
+            previous = revision
+
+
+def expand_history(apps, schema_editor):
+    for model_name, (owner, names, filters) in FIELDS.items():
+        Model = apps.get_model('content', model_name)
+        texts = {}
+        for revision in Model.objects.order_by('pk').iterator():
+            texts[revision.pk] = dict((name, getattr(revision, 'stored_' + name)) for name in names)
+            if revision.base_id is None:
+                continue
+            for name in names:
+                texts[revision.pk][name] = apply_delta(texts[revision.base_id][name], texts[revision.pk][name])
+            update = dict(('stored_' + name, texts[revision.pk][name]) for name in names)
+            Model.objects.filter(pk=revision.pk).update(base=None, chain_length=0, **update)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0025_searchdocument'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.RenameField(
+                model_name='pagehistory',
+                old_name='content',
+                new_name='stored_content',
+            ),
+            migrations.AlterField(
+                model_name='pagehistory',
+                name='stored_content',
+                field=models.TextField(blank=True, db_column='content', editable=False),
+            ),
+            migrations.RenameField(
+                model_name='pagehistory',
+                old_name='extra_header_content',
+                new_name='stored_extra_header_content',
+            ),
+            migrations.AlterField(
+                model_name='pagehistory',
+                name='stored_extra_header_content',
+                field=models.TextField(blank=True, db_column='extra_header_content', editable=False),
+            ),
+            migrations.RenameField(
+                model_name='blogentryhistory',
+                old_name='content',
+                new_name='stored_content',
+            ),
+            migrations.AlterField(
+                model_name='blogentryhistory',
+                name='stored_content',
+                field=models.TextField(blank=True, db_column='content', editable=False),
+            ),
+        ]),
+        migrations.AddField(
+            model_name='pagehistory',
+            name='base',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='dependents', to='content.PageHistory'),
+        ),
+        migrations.AddField(
+            model_name='pagehistory',
+            name='chain_length',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='blogentryhistory',
+            name='base',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='dependents', to='content.BlogEntryHistory'),
+        ),
+        migrations.AddField(
+            model_name='blogentryhistory',
+            name='chain_length',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(compress_history, expand_history),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2026-10-18 17:29
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0026_history_deltas'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='pagehistory',
+            index_together=set([('type', 'modified')]),
+        ),
+    ]
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2026-10-18 17:32
+from __future__ import unicode_literals
+
+from hashlib import sha1
+import json
+
+from django.db import migrations, models
+
+
+# Copies of content.models.make_content_hash and content.delta.apply_delta
+# as they were when this migration was written.
+def make_content_hash(*values):
+    return sha1('\0'.join(values).encode('utf-8')).hexdigest()
+
+
+def apply_delta(base, delta):
+    base_lines = base.splitlines(True)
+    output = []
+    for op in json.loads(delta):
+        if isinstance(op, list):
+            output.extend(base_lines[op[0]:op[1]])
+        else:
+            output.append(op)
+    return ''.join(output)
+
+
+def fill_hashes(apps, schema_editor):
+    for model_name, fields in [
+        ('Page', ['title', 'content', 'extra_header_content']),
+        ('BlogEntry', ['title', 'content']),
+    ]:
+        Model = apps.get_model('content', model_name)
+        for obj in Model.objects.only(*fields).iterator():
+            Model.objects.filter(pk=obj.pk).update(
+                content_hash=make_content_hash(*[getattr(obj, f) for f in fields])
+            )
+
+    for model_name, owner, names in [
+        ('PageHistory', 'page_id', ['content', 'extra_header_content']),
+        ('BlogEntryHistory', 'entry_id', ['content']),
+    ]:
+        Model = apps.get_model('content', model_name)
+        texts = {}
+        previous_owner = None
+        for revision in Model.objects.order_by(owner, 'pk').iterator():
+            if getattr(revision, owner) != previous_owner:
+                # Revisions are only stored against others of the same object.
+                texts = {}
+                previous_owner = getattr(revision, owner)
+            text = [getattr(revision, 'stored_' + name) for name in names]
+            if revision.base_id is not None:
+                text = [apply_delta(b, t) for b, t in zip(texts[revision.base_id], text)]
+            texts[revision.pk] = text
+            Model.objects.filter(pk=revision.pk).update(
+                content_hash=make_content_hash(revision.title, *text)
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0027_pagehistory_type_modified_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blogentry',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=40),
+        ),
+        migrations.AddField(
+            model_name='blogentryhistory',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=40),
+        ),
+        migrations.AddField(
+            model_name='page',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=40),
+        ),
+        migrations.AddField(
+            model_name='pagehistory',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=40),
+        ),
+        migrations.RunPython(fill_hashes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2026-10-18 19:05
+from __future__ import unicode_literals
+
+from hashlib import sha1
+
+from django.db import migrations, models
+
+
+def make_path_hash(path):
+    return sha1(path.encode('utf-8')).hexdigest()
+
+
+def fill_hashes(apps, schema_editor):
+    Page = apps.get_model('content', 'Page')
+    for pk, path in Page.objects.values_list('pk', 'path').iterator():
+        Page.objects.filter(pk=pk).update(path_hash=make_path_hash(path))
+    PageRedirect = apps.get_model('content', 'PageRedirect')
+    for pk, old_path in PageRedirect.objects.values_list('pk', 'old_path').iterator():
+        PageRedirect.objects.filter(pk=pk).update(old_path_hash=make_path_hash(old_path))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0029_mediaimage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='page',
+            name='path',
+            field=models.TextField(editable=False),
+        ),
+        migrations.AddField(
+            model_name='page',
+            name='path_hash',
+            field=models.CharField(editable=False, max_length=40, null=True),
+        ),
+        migrations.AlterField(
+            model_name='pageredirect',
+            name='old_path',
+            field=models.TextField(),
+        ),
+        migrations.AddField(
+            model_name='pageredirect',
+            name='old_path_hash',
+            field=models.CharField(max_length=40, null=True),
+        ),
+        migrations.AlterField(
+            model_name='contentchange',
+            name='path',
+            field=models.TextField(blank=True),
+        ),
+        migrations.RunPython(fill_hashes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='page',
+            name='path_hash',
+            field=models.CharField(editable=False, max_length=40, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='pageredirect',
+            name='old_path_hash',
+            field=models.CharField(max_length=40, unique=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2026-10-18 18:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0032_menuentry_modified'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediaimage',
+            name='claimed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,12 +1,18 @@
 from __future__ import unicode_literals
 
+from hashlib import sha1
+import json
+
 from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, CharField, TextField, Value, When
+from django.dispatch import Signal
 from django.utils import timezone
 
 from mptt.models import MPTTModel, TreeForeignKey
 
+from content.delta import SNAPSHOT_INTERVAL, apply_delta, make_delta
 from layout.models import TemplateField
 
 from website import settings
@@ -21,6 +27,37 @@ REVISION_TYPE_CHOICES = (
 	('F', 'Future'),
 	('H', 'History'),
 )
+SEARCH_KIND_CHOICES = (
+	('P', 'Page'),
+	('B', 'Blog entry'),
+)
+CHANGE_KIND_CHOICES = (
+	('P', 'Page'),
+	('B', 'Blog entry'),
+	('M', 'Menu'),
+	('L', 'Layout'),
+)
+
+# Sent once by bulk_update() for all the objects it changed, as post_save
+# would be for each of them.
+bulk_updated = Signal(providing_args=['pks'])
+
+
+def make_content_hash(*values):
+	return sha1('\0'.join(values).encode('utf-8')).hexdigest()
+
+
+def make_path_hash(path):
+	# Paths can be longer than a column that can be indexed, so they're
+	# looked up by hash.
+	return sha1(path.encode('utf-8')).hexdigest()
+
+
+def join_path(parent_path, alias):
+	# The home page lives at the root, and so do its children.
+	if alias == 'home':
+		return parent_path or '/'
+	return (parent_path or '').rstrip('/') + '/' + alias
 
 
 class Page(MPTTModel):
@@ -33,18 +70,71 @@ class Page(MPTTModel):
 	modified = models.DateTimeField()
 	modifier = models.ForeignKey(settings.AUTH_USER_MODEL, editable=False)
 	status = models.CharField(max_length=1, choices=PUBLISH_STATUS_CHOICES, default='D')
+	# The full URL path, kept up to date by save() so it doesn't have to be
+	# built from the ancestors every time.
+	path = models.TextField(editable=False)
+	path_hash = models.CharField(max_length=40, unique=True, editable=False)
+	# Of the fields that are kept in the history, to tell cheaply whether they changed.
+	content_hash = models.CharField(max_length=40, blank=True, editable=False)
 	# Update signals.py if changing field count.
 
 	def __unicode__(self):
 		return self.alias
 
 	def get_absolute_url(self):
-		parts = []
-		for page in self.get_ancestors(include_self=True):
-			if page.alias == 'home':
-				continue
-			parts.append(page.alias)
-		return '/' + '/'.join(parts)
+		return self.path
+
+	def get_content_hash(self):
+		return make_content_hash(self.title, self.content, self.extra_header_content)
+
+	def clean(self):
+		# Anywhere else it would have the same path as its parent.
+		if self.alias == 'home' and self.parent_id is not None:
+			raise ValidationError({'parent': 'The home page must be at the top level.'})
+
+	def build_path(self):
+		parent = self.parent
+		return join_path(parent.path if parent else None, self.alias)
+
+	def update_descendant_paths(self):
+		paths = {self.pk: self.path}
+		moves = []
+		for page in self.get_descendants().only('parent', 'alias', 'path'):
+			path = join_path(paths[page.parent_id], page.alias)
+			paths[page.pk] = path
+			if path != page.path:
+				moves.append((page.pk, page.path, path))
+
+		for i in range(0, len(moves), 500):
+			batch = moves[i:i + 500]
+			Page.objects.filter(pk__in=[pk for pk, old_path, path in batch]).update(
+				path=Case(
+					*[When(pk=pk, then=Value(path)) for pk, old_path, path in batch],
+					output_field=TextField()
+				),
+				path_hash=Case(
+					*[When(pk=pk, then=Value(make_path_hash(path))) for pk, old_path, path in batch],
+					output_field=CharField()
+				),
+			)
+		return moves
+
+	@classmethod
+	def bulk_update(cls, queryset, modifier, **values):
+		def make_revision(page):
+			# bulk_create() doesn't call save(), so store the text in full.
+			return PageHistory(
+				page=page,
+				type='D' if page.status == 'D' else 'H',
+				title=page.title,
+				stored_content=page.content,
+				stored_extra_header_content=page.extra_header_content,
+				content_hash=page.content_hash,
+				modifier=modifier,
+			)
+		return bulk_update(
+			cls, queryset, make_revision, modified=timezone.now(), modifier=modifier, **values
+		)
 
 	@property
 	def draft_set(self):
@@ -67,21 +157,212 @@ class Page(MPTTModel):
 	def save(self, update_fields=None, **kwargs):
 		self.content = self.content.replace('\r', '')
 		self.extra_header_content = self.extra_header_content.replace('\r', '')
+
+		old_hash = self.content_hash
+		self.content_hash = self.get_content_hash()
+		if update_fields is not None and self.content_hash != old_hash:
+			update_fields = list(update_fields) + ['content_hash']
+
+		old_path = self.path
+		self.path = self.build_path()
+		self.path_hash = make_path_hash(self.path)
+		if update_fields is not None and self.path != old_path:
+			update_fields = list(update_fields) + ['path', 'path_hash']
+
 		super(Page, self).save(update_fields=update_fields, **kwargs)
 
+		if old_path and self.path != old_path:
+			moves = [(self.pk, old_path, self.path)]
+			moves.extend(self.update_descendant_paths())
+			PageRedirect.add(moves)
+			# The new paths will be looked up by object_id, but the old ones need
+			# recording so anything cached under them can be cleaned up.
+			ContentChange.objects.bulk_create([
+				ContentChange(kind='P', object_id=pk, path=old_path) for pk, old_path, path in moves
+			])
+
+
+class PageRedirect(models.Model):
+	old_path = models.TextField()
+	old_path_hash = models.CharField(max_length=40, unique=True)
+	page = models.ForeignKey('Page', related_name='redirects')
+
+	def __unicode__(self):
+		return '%s -> %s' % (self.old_path, self.page)
+
+	@classmethod
+	def add(cls, moves):
+		for i in range(0, len(moves), 250):
+			batch = moves[i:i + 250]
+			# Pages can be moved back to where they were, and a page's old path
+			# can only be reused by the same page, so replace existing rows.
+			cls.objects.filter(
+				old_path_hash__in=[make_path_hash(old_path) for pk, old_path, path in batch] +
+				[make_path_hash(path) for pk, old_path, path in batch]
+			).delete()
+			cls.objects.bulk_create([
+				cls(old_path=old_path, old_path_hash=make_path_hash(old_path), page_id=pk)
+				for pk, old_path, path in batch
+			])
+
+
+def bulk_update(model, queryset, make_revision, **values):
+	# Updates every object in the queryset and adds a revision for each with
+	# a few queries per batch, instead of saving them one at a time.
+	pks = list(queryset.values_list('pk', flat=True))
+	with transaction.atomic():
+		for i in range(0, len(pks), 500):
+			batch = pks[i:i + 500]
+			model.objects.filter(pk__in=batch).update(**values)
+			revisions = [make_revision(obj) for obj in model.objects.filter(pk__in=batch)]
+			if revisions:
+				type(revisions[0]).objects.bulk_create(revisions)
+	bulk_updated.send(sender=model, pks=pks)
+	return len(pks)
+
+
+def delta_field(name):
+	# Reads and writes the text of a revision, which is stored in stored_<name>
+	# either in full or as a delta against the base revision.
+	def get(self):
+		texts = self.__dict__.setdefault('_texts', {})
+		if name not in texts:
+			stored = getattr(self, 'stored_' + name)
+			if self.base_id is None:
+				texts[name] = stored
+			else:
+				self._load_bases()
+				texts[name] = apply_delta(getattr(self.base, name), stored)
+		return texts[name]
+
+	def set(self, value):
+		self.__dict__.setdefault('_texts', {})[name] = value
+
+	return property(get, set)
+
+
+class DeltaRevision(models.Model):
+	base = models.ForeignKey(
+		'self', null=True, blank=True, editable=False, related_name='dependents'
+	)
+	chain_length = models.PositiveSmallIntegerField(default=0, editable=False)
+	# Of the title and delta_fields, the same as the object's content_hash.
+	content_hash = models.CharField(max_length=40, blank=True, editable=False)
+
+	delta_fields = ()
 
-class PageHistory(models.Model):
+	class Meta:
+		abstract = True
+
+	def get_chain_queryset(self):
+		# The revisions that can be stored as deltas against each other.
+		raise NotImplementedError
+
+	def can_be_delta(self):
+		return True
+
+	def get_content_hash(self):
+		return make_content_hash(self.title, *[getattr(self, name) for name in self.delta_fields])
+
+	def _load_bases(self):
+		# Fetch the whole chain in one query rather than one per revision.
+		if type(self).base.is_cached(self):
+			return
+		revisions = dict(
+			(r.pk, r) for r in self.get_chain_queryset()
+			.filter(pk__lte=self.base_id).order_by('-pk')[:SNAPSHOT_INTERVAL]
+		)
+		revision = self
+		while revision.base_id in revisions and not type(self).base.is_cached(revision):
+			revision.base = revisions[revision.base_id]
+			revision = revision.base
+
+	def _detach_dependents(self, original):
+		# Revisions stored against this one have to be stored in full before
+		# it changes or goes away.
+		for dependent in self.dependents.all():
+			dependent.base = original
+			texts = [(name, getattr(dependent, name)) for name in self.delta_fields]
+			dependent.base = None
+			dependent.chain_length = 0
+			for name, value in texts:
+				setattr(dependent, 'stored_' + name, value)
+			dependent.save(update_fields=['base', 'chain_length'] + [
+				'stored_' + name for name, _ in texts
+			])
+
+	def refresh_from_db(self, *args, **kwargs):
+		self.__dict__.pop('_texts', None)
+		super(DeltaRevision, self).refresh_from_db(*args, **kwargs)
+
+	def save(self, *args, **kwargs):
+		texts = dict((name, getattr(self, name)) for name in self.delta_fields)
+		self.content_hash = self.get_content_hash()
+
+		if self.pk is not None and self.dependents.exists():
+			original = type(self).objects.exclude(content_hash=self.content_hash).filter(
+				pk=self.pk
+			).first()
+			if original is not None and \
+					any(getattr(original, name) != texts[name] for name in self.delta_fields):
+				self._detach_dependents(original)
+
+		if not self.can_be_delta():
+			self.base = None
+		elif self.pk is None:
+			self.base = self.get_chain_queryset().order_by('-pk').first()
+			if self.base is not None and self.base.chain_length + 1 >= SNAPSHOT_INTERVAL:
+				self.base = None
+		self.chain_length = self.base.chain_length + 1 if self.base is not None else 0
+
+		for name in self.delta_fields:
+			if self.base is None:
+				setattr(self, 'stored_' + name, texts[name])
+			else:
+				setattr(self, 'stored_' + name, make_delta(getattr(self.base, name), texts[name]))
+
+		update_fields = kwargs.get('update_fields')
+		if update_fields is not None:
+			update_fields = set(update_fields)
+			for name in self.delta_fields:
+				if name in update_fields:
+					update_fields.remove(name)
+					update_fields.update(['stored_' + name, 'base', 'chain_length'])
+			if update_fields.intersection(['title'] + ['stored_' + n for n in self.delta_fields]):
+				update_fields.add('content_hash')
+			kwargs['update_fields'] = update_fields
+		super(DeltaRevision, self).save(*args, **kwargs)
+
+	def delete(self, *args, **kwargs):
+		self._detach_dependents(self)
+		return super(DeltaRevision, self).delete(*args, **kwargs)
+
+
+class PageHistory(DeltaRevision):
 	page = models.ForeignKey('Page', related_name='revisions')
 	type = models.CharField(max_length=1, choices=REVISION_TYPE_CHOICES, default='H')
 	title = models.CharField(max_length=255)
-	content = models.TextField(blank=True)
-	extra_header_content = models.TextField(blank=True)
+	stored_content = models.TextField(blank=True, db_column='content', editable=False)
+	stored_extra_header_content = models.TextField(
+		blank=True, db_column='extra_header_content', editable=False
+	)
 	modified = models.DateTimeField(editable=False, auto_now_add=True)
 	modifier = models.ForeignKey(settings.AUTH_USER_MODEL, editable=False)
 
+	delta_fields = ('content', 'extra_header_content')
+	content = delta_field('content')
+	extra_header_content = delta_field('extra_header_content')
+
 	def __unicode__(self):
 		return '%s @ %s [%s]' % (self.page, self.modified, self.type)
 
+	def get_chain_queryset(self):
+		return PageHistory.objects.filter(page_id=self.page_id, type='H')
+
+	def can_be_delta(self):
+		# Drafts and future revisions get edited, so keep them whole.
+		return self.type == 'H'
+
 	def get_absolute_url(self):
 		return self.page.get_absolute_url() + '?revision=%d' % self.pk
 
@@ -93,7 +374,12 @@ class PageHistory(models.Model):
 			return None
 		return self.page.get_change_url(self.pk)
 
+	class Meta:
+		# For finding future revisions that are due.
+		index_together = (('type', 'modified'),)
+
 	def make_current(self, modifier):
+		scheduled = self.type == 'F'
 		if self.type == 'H':
 			self.pk = None
 		else:
@@ -101,15 +387,36 @@ class PageHistory(models.Model):
 		self.modifier = modifier
 		self.save()
 
+		page = self.page
+		page.title = self.title
+		page.content = self.content
+		page.extra_header_content = self.extra_header_content
+		page.modified = self.modified
+		page.modifier = modifier
+		update_fields = ['title', 'content', 'extra_header_content', 'modified', 'modifier']
+		if scheduled:
+			page.status = 'P'
+			update_fields.append('status')
+		# This revision is already in the history, so don't save another.
+		page.save(update_fields=update_fields)
+
 
 class MenuEntry(MPTTModel):
 	label = models.CharField(max_length=255)
 	href = models.CharField(max_length=255, blank=True, verbose_name='Links to')
 	parent = TreeForeignKey('self', null=True, blank=True, related_name='children', db_index=True)
+	# Also touched on every entry when one is moved or deleted, see signals.py.
+	modified = models.DateTimeField(auto_now=True)
 
 	def __unicode__(self):
 		return self.label
 
+	@classmethod
+	def get_modified(cls):
+		# When the menu last changed, from the database so that every process
+		# agrees on it.
+		return cls.objects.aggregate(models.Max('modified'))['modified__max']
+
 	class Meta:
 		verbose_name_plural = 'menu entries'
 
@@ -123,10 +430,33 @@ class BlogEntry(models.Model):
 	content = models.TextField()
 	tags = models.CharField(max_length=255, blank=True)
 	status = models.CharField(max_length=1, choices=PUBLISH_STATUS_CHOICES)
+	# Kept in sync with tags by signals.py, so tag lookups can use an index.
+	tag_set = models.ManyToManyField('Tag', related_name='entries', editable=False)
+	# Of the fields that are kept in the history, to tell cheaply whether they changed.
+	content_hash = models.CharField(max_length=40, blank=True, editable=False)
 
 	def __unicode__(self):
 		return self.title
 
+	def save(self, *args, **kwargs):
+		self.content_hash = self.get_content_hash()
+		if kwargs.get('update_fields') is not None:
+			kwargs['update_fields'] = list(kwargs['update_fields']) + ['content_hash']
+
+		old = None
+		if self.pk is not None:
+			old = BlogEntry.objects.filter(pk=self.pk).only('created', 'slug').first()
+
+		super(BlogEntry, self).save(*args, **kwargs)
+
+		if old is not None and old.get_absolute_url() != self.get_absolute_url():
+			# The new URL is recorded by signals.py, but the old one needs
+			# recording too so anything exported under it can be cleaned up.
+			ContentChange.record('B', self.pk, old.get_absolute_url())
+
+	def get_content_hash(self):
+		return make_content_hash(self.title, self.content)
+
 	def dateslug(self):
 		return self.created.strftime('%Y-%m')
 
@@ -136,9 +466,34 @@ class BlogEntry(models.Model):
 	def get_tags(self):
 		return self.tags.split(' ')
 
+	@classmethod
+	def bulk_update(cls, queryset, modifier, **values):
+		def make_revision(entry):
+			# bulk_create() doesn't call save(), so store the text in full.
+			return BlogEntryHistory(
+				entry=entry, title=entry.title, stored_content=entry.content,
+				content_hash=entry.content_hash, modifier=modifier
+			)
+		return bulk_update(
+			cls, queryset, make_revision, modified=timezone.now(), modifier=modifier, **values
+		)
+
 	def set_tags(self, tags=[]):
 		self.tags = ' '.join(tags)
 
+	def update_tag_set(self):
+		names = set(t for t in self.get_tags() if t)
+		old_ids = set(self.tag_set.values_list('pk', flat=True))
+
+		tags = list(Tag.objects.filter(name__in=names))
+		missing = names - set(t.name for t in tags)
+		if missing:
+			Tag.objects.bulk_create([Tag(name=name) for name in missing])
+			tags = list(Tag.objects.filter(name__in=names))
+
+		self.tag_set.set(tags)
+		Tag.update_counts(old_ids | set(t.pk for t in tags))
+
 	def validate_unique(self, exclude=None):
 		super(BlogEntry, self).validate_unique(exclude)
 
@@ -165,14 +520,111 @@ class BlogEntry(models.Model):
 
 	class Meta:
 		verbose_name_plural = 'blog entries'
+		index_together = (('created', 'id'),)
+
+
+class Tag(models.Model):
+	name = models.CharField(max_length=255, unique=True)
+	# The number of published entries with this tag.
+	entry_count = models.PositiveIntegerField(default=0, editable=False)
+
+	def __unicode__(self):
+		return self.name
+
+	def get_absolute_url(self):
+		return reverse('blog_list', kwargs={'tag': self.name})
+
+	@classmethod
+	def update_counts(cls, tag_ids):
+		tag_ids = list(tag_ids)
+		through = BlogEntry.tag_set.through
+		for i in range(0, len(tag_ids), 500):
+			batch = tag_ids[i:i + 500]
+			counts = dict(
+				through.objects.filter(tag_id__in=batch, blogentry__status='P')
+				.values_list('tag_id').annotate(models.Count('pk'))
+			)
+			for tag_id in batch:
+				cls.objects.filter(pk=tag_id).update(entry_count=counts.get(tag_id, 0))
+
+	class Meta:
+		ordering = ('name',)
 
 
-class BlogEntryHistory(models.Model):
+class BlogEntryHistory(DeltaRevision):
 	entry = models.ForeignKey('BlogEntry')
 	title = models.CharField(max_length=255)
-	content = models.TextField(blank=True)
+	stored_content = models.TextField(blank=True, db_column='content', editable=False)
 	modified = models.DateTimeField(editable=False, auto_now_add=True)
 	modifier = models.ForeignKey(settings.AUTH_USER_MODEL, editable=False)
 
+	delta_fields = ('content',)
+	content = delta_field('content')
+
 	def __unicode__(self):
 		return '%s @ %s' % (self.entry, self.modified)
+
+	def get_chain_queryset(self):
+		return BlogEntryHistory.objects.filter(entry_id=self.entry_id)
+
+
+class ContentChange(models.Model):
+	kind = models.CharField(max_length=1, choices=CHANGE_KIND_CHOICES)
+	object_id = models.PositiveIntegerField(null=True, blank=True)
+	path = models.TextField(blank=True)
+	changed = models.DateTimeField(auto_now_add=True)
+
+	def __unicode__(self):
+		return '%s %s @ %s' % (self.get_kind_display(), self.path, self.changed)
+
+	@classmethod
+	def record(cls, kind, object_id=None, path=''):
+		cls.objects.create(kind=kind, object_id=object_id, path=path)
+
+	@classmethod
+	def record_queryset(cls, kind, queryset):
+		cls.objects.bulk_create([
+			cls(kind=kind, object_id=obj.pk, path=obj.get_absolute_url()) for obj in queryset
+		])
+
+
+class SearchDocument(models.Model):
+	# Searchable text of a page or blog entry. On SQLite this is mirrored into
+	# an FTS5 table by triggers, and on MySQL it has a FULLTEXT index. See search.py.
+	kind = models.CharField(max_length=1, choices=SEARCH_KIND_CHOICES)
+	object_id = models.PositiveIntegerField()
+	title = models.CharField(max_length=255)
+	body = models.TextField(blank=True)
+
+	def __unicode__(self):
+		return '%s %d: %s' % (self.get_kind_display(), self.object_id, self.title)
+
+	class Meta:
+		unique_together = (('kind', 'object_id'),)
+
+
+class MediaImage(models.Model):
+	# An index of the files under MEDIA_ROOT/images, so the image picker
+	# doesn't have to walk the directory. Kept up to date by the file browser
+	# and reconciled with the disk by the index_images command. See images.py.
+	path = models.CharField(max_length=255, unique=True)
+	size = models.PositiveIntegerField()
+	mtime = models.FloatField()
+	width = models.PositiveIntegerField(null=True, blank=True)
+	height = models.PositiveIntegerField(null=True, blank=True)
+	# JSON: thumbnail names relative to MEDIA_ROOT, by alias.
+	thumbnails = models.TextField(blank=True, default='{}')
+	# Waiting for the make_thumbnails command.
+	pending = models.BooleanField(default=False, db_index=True)
+	# When the make_thumbnails command took it on. Taken on again if it's
+	# still pending well after that, e.g. because the command died.
+	claimed = models.DateTimeField(null=True, blank=True)
+
+	def __unicode__(self):
+		return self.path
+
+	def get_thumbnails(self):
+		return json.loads(self.thumbnails or '{}')
+
+	def set_thumbnails(self, thumbnails):
+		self.thumbnails = json.dumps(thumbnails, sort_keys=True)
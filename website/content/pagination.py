@@ -0,0 +1,64 @@
+from calendar import timegm
+from datetime import datetime, timedelta
+
+from django.db.models import Q
+from django.utils.timezone import utc
+
+EPOCH = datetime(1970, 1, 1, tzinfo=utc)
+
+
+def make_cursor(entry):
+	created = entry.created
+	return '%d-%d' % (timegm(created.utctimetuple()) * 1000000 + created.microsecond, entry.pk)
+
+
+def parse_cursor(value):
+	try:
+		created, pk = value.split('-')
+		return EPOCH + timedelta(microseconds=int(created)), int(pk)
+	except (AttributeError, ValueError, OverflowError):
+		return None
+
+
+class KeysetPage(object):
+	# A page of blog entries, newest first, that starts before or after an
+	# entry rather than at an offset, so every page is as cheap as the first.
+	# Cursors are (created, pk), which is unique and indexed.
+
+	def __init__(self, queryset, per_page, before=None, after=None):
+		if after is not None:
+			created, pk = after
+			items = list(
+				queryset.filter(Q(created__gt=created) | Q(created=created, pk__gt=pk))
+				.order_by('created', 'pk')[:per_page + 1]
+			)
+			if len(items) > per_page:
+				self.object_list = items[:per_page][::-1]
+				self.has_previous = True
+				self.has_next = True
+				return
+			# We're back at the start, so show a full first page.
+			before = None
+
+		if before is not None:
+			created, pk = before
+			queryset = queryset.filter(Q(created__lt=created) | Q(created=created, pk__lt=pk))
+		items = list(queryset.order_by('-created', '-pk')[:per_page + 1])
+		self.object_list = items[:per_page]
+		self.has_previous = before is not None and len(self.object_list) > 0
+		self.has_next = len(items) > per_page
+
+	def __iter__(self):
+		return iter(self.object_list)
+
+	def __len__(self):
+		return len(self.object_list)
+
+	def has_other_pages(self):
+		return self.has_previous or self.has_next
+
+	def previous_query(self):
+		return 'after=' + make_cursor(self.object_list[0])
+
+	def next_query(self):
+		return 'before=' + make_cursor(self.object_list[-1])
@@ -0,0 +1,133 @@
+from hashlib import md5
+import os, re
+
+from django.utils.html import escape
+from django.utils.http import urlquote, urlunquote
+
+from content import images
+from content.cache import get_cached_responsive, set_cached_responsive
+from content.models import MediaImage
+from website import settings
+
+IMG_RE = re.compile(r'<img\b[^>]*>', re.IGNORECASE)
+ATTRIBUTE_RE = re.compile(r'''([^\s"'>/=]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s"'>]+))?''')
+
+
+def _get_attributes(tag):
+	attributes = {}
+	for name, value in ATTRIBUTE_RE.findall(tag[len('<img'):].rstrip('/>')):
+		if value[:1] in ('"', "'"):
+			value = value[1:-1]
+		attributes[name.lower()] = value
+	return attributes
+
+
+def _get_path(src):
+	# The image's path relative to MEDIA_ROOT, if it's one of ours.
+	src = urlunquote(src.replace('&amp;', '&'))
+	prefix = settings.MEDIA_URL + images.IMAGES_DIR + '/'
+	if src.startswith(prefix) and '?' not in src and '#' not in src:
+		path = src[len(settings.MEDIA_URL):]
+		if os.path.normpath(path) == path:
+			return path
+	return None
+
+
+def _rewrite(tag, attributes, image):
+	added = []
+	variants = []
+	for alias, name in image.get_thumbnails().items():
+		width = images.get_variant_width(alias)
+		if width is not None and width < image.width:
+			variants.append((width, name))
+	variants.sort()
+	source = []
+	if variants and 'srcset' not in attributes:
+		srcset = ['%s %dw' % (urlquote(settings.MEDIA_URL + name), width) for width, name in variants]
+		srcset.append('%s %dw' % (urlquote(settings.MEDIA_URL + image.path), image.width))
+		source.append(('type', 'image/' + settings.IMAGE_VARIANT_FORMAT))
+		source.append(('srcset', ', '.join(srcset)))
+		# Never wider than it's shown, or than the image itself.
+		try:
+			shown = int(attributes.get('width', image.width))
+		except ValueError:
+			shown = image.width
+		source.append(('sizes', attributes.get('sizes') or '(max-width: %dpx) 100vw, %dpx' % (shown, shown)))
+
+	# So the page doesn't jump about as images arrive.
+	if 'width' not in attributes and 'height' not in attributes:
+		added.append(('width', image.width))
+		added.append(('height', image.height))
+	if 'loading' not in attributes:
+		added.append(('loading', 'lazy'))
+
+	if added:
+		end = '/>' if tag.endswith('/>') else '>'
+		tag = '%s %s%s%s' % (tag[:-len(end)].rstrip(), _format(added), ' ' if end == '/>' else '', end)
+	if source:
+		# Browsers that can't show the variants' format show the image itself.
+		tag = '<picture><source %s>%s</picture>' % (_format(source), tag)
+	return tag
+
+
+def _format(attributes):
+	return ' '.join('%s="%s"' % (name, escape(value)) for name, value in attributes)
+
+
+def _get_tags(html):
+	tags = []
+	for match in IMG_RE.finditer(html):
+		attributes = _get_attributes(match.group(0))
+		tags.append((match, attributes, _get_path(attributes.get('src', ''))))
+	return tags
+
+
+def _get_images(tags):
+	paths = set(path for match, attributes, path in tags if path is not None)
+	if not paths:
+		return {}
+	return dict((image.path, image) for image in MediaImage.objects.filter(path__in=paths))
+
+
+def _get_signature(indexed):
+	# Changes whenever one of the images changes or gets new variants.
+	return md5(repr(sorted(
+		(path, image.mtime, image.width, image.height, image.thumbnails)
+		for path, image in indexed.items()
+	)).encode('utf-8')).hexdigest()
+
+
+def find_images(html):
+	# The images in html, for passing to both get_images_signature and
+	# add_srcset so they're only looked up once.
+	tags = _get_tags(html)
+	return tags, _get_images(tags)
+
+
+def get_images_signature(html, found=None):
+	# For the ETags of pages whose content goes through add_srcset.
+	tags, indexed = found or find_images(html)
+	return _get_signature(indexed)
+
+
+def add_srcset(html, found=None):
+	# Gives the images in html, e.g. a page's content, the smaller variants
+	# that have been made of them to choose from, along with their size.
+	tags, indexed = found or find_images(html)
+	signature = _get_signature(indexed)
+	result = get_cached_responsive(html, signature)
+	if result is not None:
+		return result
+
+	parts = []
+	last = 0
+	for match, attributes, path in tags:
+		image = indexed.get(path)
+		if image is not None and image.width is not None:
+			parts.append(html[last:match.start()])
+			parts.append(_rewrite(match.group(0), attributes, image))
+			last = match.end()
+	parts.append(html[last:])
+	result = ''.join(parts)
+	set_cached_responsive(html, signature, result)
+	return result
@@ -0,0 +1,134 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.utils.html import strip_tags
+
+from content.models import BlogEntry, Page, SearchDocument
+
+TABLE = SearchDocument._meta.db_table
+FTS_TABLE = TABLE + '_fts'
+
+_backend = []
+
+
+def get_backend():
+	if not _backend:
+		if connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names():
+			_backend.append('sqlite')
+		elif connection.vendor == 'mysql':
+			_backend.append('mysql')
+		else:
+			# Nothing better available, search with LIKE.
+			_backend.append(None)
+	return _backend[0]
+
+
+def index_object(kind, obj):
+	SearchDocument.objects.update_or_create(kind=kind, object_id=obj.pk, defaults={
+		'title': obj.title,
+		'body': strip_tags(obj.content),
+	})
+
+
+def remove_object(kind, pk):
+	SearchDocument.objects.filter(kind=kind, object_id=pk).delete()
+
+
+def _get_terms(query):
+	return re.findall(r'\w+', query, re.UNICODE)
+
+
+def _get_match(terms):
+	backend = get_backend()
+	if backend == 'sqlite':
+		return ' '.join('"%s"*' % t for t in terms)
+	elif backend == 'mysql':
+		return ' '.join('+%s*' % t for t in terms)
+
+
+def _get_like_filter(terms):
+	q = Q()
+	for t in terms:
+		q &= Q(title__icontains=t) | Q(body__icontains=t)
+	return q
+
+
+MODELS = {'P': Page, 'B': BlogEntry}
+
+
+def search(query, kind=None, limit=50, published_only=()):
+	# Returns (kind, object_id) pairs, best matches first. Of the kinds in
+	# published_only, only published objects are returned.
+	terms = _get_terms(query)
+	if not terms:
+		return []
+
+	backend = get_backend()
+	if backend is None:
+		documents = SearchDocument.objects.filter(_get_like_filter(terms)).order_by('title')
+		if kind is not None:
+			documents = documents.filter(kind=kind)
+		for k in published_only:
+			documents = documents.filter(~Q(kind=k) | Q(
+				object_id__in=MODELS[k].objects.filter(status='P').values('pk')
+			))
+		return list(documents.values_list('kind', 'object_id')[:limit])
+
+	params = [_get_match(terms)]
+	kind_sql = ''
+	if kind is not None:
+		kind_sql = 'AND d.kind = %s'
+		params.append(kind)
+	# Filtered here rather than by the caller, so drafts don't use up the limit.
+	for k in published_only:
+		kind_sql += " AND (d.kind != %%s OR d.object_id IN (SELECT id FROM %s WHERE status = 'P'))" % (
+			MODELS[k]._meta.db_table
+		)
+		params.append(k)
+
+	if backend == 'sqlite':
+		# Matches in the title count for more than in the body.
+		sql = (
+			'SELECT d.kind, d.object_id FROM %s f JOIN %s d ON d.id = f.rowid '
+			'WHERE %s MATCH %%s %s ORDER BY bm25(%s, 10.0, 1.0) LIMIT %%s'
+		) % (FTS_TABLE, TABLE, FTS_TABLE, kind_sql, FTS_TABLE)
+	else:
+		sql = (
+			'SELECT d.kind, d.object_id FROM %s d '
+			'WHERE MATCH(d.title, d.body) AGAINST (%%s IN BOOLEAN MODE) %s '
+			'ORDER BY MATCH(d.title, d.body) AGAINST (%%s) DESC LIMIT %%s'
+		) % (TABLE, kind_sql)
+		params.append(' '.join(terms))
+	params.append(limit)
+
+	with connection.cursor() as cursor:
+		cursor.execute(sql, params)
+		return cursor.fetchall()
+
+
+def filter_queryset(queryset, kind, query):
+	terms = _get_terms(query)
+	if not terms:
+		return queryset
+
+	backend = get_backend()
+	if backend is None:
+		return queryset.filter(pk__in=SearchDocument.objects.filter(
+			_get_like_filter(terms), kind=kind
+		).values('object_id'))
+
+	if backend == 'sqlite':
+		subquery = (
+			'SELECT d.object_id FROM %s f JOIN %s d ON d.id = f.rowid '
+			'WHERE %s MATCH %%s AND d.kind = %%s'
+		) % (FTS_TABLE, TABLE, FTS_TABLE)
+	else:
+		subquery = (
+			'SELECT d.object_id FROM %s d '
+			'WHERE MATCH(d.title, d.body) AGAINST (%%s IN BOOLEAN MODE) AND d.kind = %%s'
+		) % TABLE
+	return queryset.extra(
+		where=['%s.id IN (%s)' % (queryset.model._meta.db_table, subquery)],
+		params=[_get_match(terms), kind]
+	)
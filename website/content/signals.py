@@ -1,6 +1,12 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
-from .models import BlogEntry, BlogEntryHistory, Page, PageHistory
+from django.utils import timezone
+from mptt.signals import node_moved
+from . import search
+from .cache import invalidate_feeds, invalidate_pages
+from .models import (
+	BlogEntry, BlogEntryHistory, ContentChange, MenuEntry, Page, PageHistory, Tag, bulk_updated
+)
 
 
 @receiver(post_save, sender=Page, dispatch_uid='page_history_saver')
@@ -20,12 +26,24 @@ def page_history_saver(update_fields=None, **kwargs):
 	)
 	if instance.status == 'D':
 		version.type = 'D'
+	latest = instance.revisions.filter(type=version.type).order_by('-pk').values_list(
+		'content_hash', flat=True
+	).first()
+	if latest == instance.content_hash:
+		# Nothing's changed since the last one.
+		return
 	version.save()
 
 
 @receiver(post_save, sender=BlogEntry, dispatch_uid='blog_entry_history_saver')
 def blog_entry_history_saver(**kwargs):
 	instance = kwargs['instance']
+	latest = BlogEntryHistory.objects.filter(entry=instance).order_by('-pk').values_list(
+		'content_hash', flat=True
+	).first()
+	if latest == instance.content_hash:
+		# Nothing's changed since the last one.
+		return
 	version = BlogEntryHistory(
 		entry=instance,
 		title=instance.title,
@@ -33,3 +51,121 @@ def blog_entry_history_saver(**kwargs):
 		modifier=instance.modifier
 	)
 	version.save()
+
+
+@receiver(post_save, sender=BlogEntry, dispatch_uid='blog_entry_tag_indexer')
+def blog_entry_tag_indexer(instance, **kwargs):
+	instance.update_tag_set()
+
+
+@receiver(pre_delete, sender=BlogEntry, dispatch_uid='blog_entry_tag_collector')
+def blog_entry_tag_collector(instance, **kwargs):
+	# The entry's tags are gone by the time post_delete fires.
+	instance._deleted_tag_ids = list(instance.tag_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=BlogEntry, dispatch_uid='blog_entry_tag_counter')
+def blog_entry_tag_counter(instance, **kwargs):
+	Tag.update_counts(getattr(instance, '_deleted_tag_ids', []))
+
+
+@receiver(post_save, sender=Page, dispatch_uid='page_search_indexer')
+def page_search_indexer(instance, **kwargs):
+	search.index_object('P', instance)
+
+
+@receiver(post_delete, sender=Page, dispatch_uid='page_search_remover')
+def page_search_remover(instance, **kwargs):
+	search.remove_object('P', instance.pk)
+
+
+@receiver(post_save, sender=BlogEntry, dispatch_uid='blog_entry_search_indexer')
+def blog_entry_search_indexer(instance, **kwargs):
+	search.index_object('B', instance)
+
+
+@receiver(post_delete, sender=BlogEntry, dispatch_uid='blog_entry_search_remover')
+def blog_entry_search_remover(instance, **kwargs):
+	search.remove_object('B', instance.pk)
+
+
+@receiver(post_save, sender=Page, dispatch_uid='page_change_recorder')
+@receiver(post_delete, sender=Page, dispatch_uid='page_change_recorder')
+def page_change_recorder(instance, **kwargs):
+	ContentChange.record('P', instance.pk, instance.path)
+
+
+@receiver(post_save, sender=BlogEntry, dispatch_uid='blog_entry_change_recorder')
+@receiver(post_delete, sender=BlogEntry, dispatch_uid='blog_entry_change_recorder')
+def blog_entry_change_recorder(instance, **kwargs):
+	ContentChange.record('B', instance.pk, instance.get_absolute_url())
+
+
+@receiver(post_save, sender=MenuEntry, dispatch_uid='menu_change_recorder')
+@receiver(post_delete, sender=MenuEntry, dispatch_uid='menu_change_recorder')
+@receiver(node_moved, sender=MenuEntry, dispatch_uid='menu_change_recorder')
+def menu_change_recorder(instance, **kwargs):
+	ContentChange.record('M', instance.pk)
+
+
+@receiver(post_delete, sender=MenuEntry, dispatch_uid='menu_modified_toucher')
+@receiver(node_moved, sender=MenuEntry, dispatch_uid='menu_modified_toucher')
+def menu_modified_toucher(**kwargs):
+	# Entries dragged about in the admin aren't saved, and deleted ones are
+	# gone, so neither moves MenuEntry.get_modified on by itself.
+	MenuEntry.objects.update(modified=timezone.now())
+
+
+@receiver(post_save, sender=Page, dispatch_uid='page_cache_invalidator')
+@receiver(post_delete, sender=Page, dispatch_uid='page_cache_invalidator')
+@receiver(node_moved, sender=Page, dispatch_uid='page_cache_invalidator')
+def page_cache_invalidator(**kwargs):
+	invalidate_pages()
+
+
+@receiver(post_save, sender=BlogEntry, dispatch_uid='feed_cache_invalidator')
+@receiver(post_delete, sender=BlogEntry, dispatch_uid='feed_cache_invalidator')
+def feed_cache_invalidator(**kwargs):
+	invalidate_feeds()
+
+
+@receiver(post_save, sender=MenuEntry, dispatch_uid='menu_cache_invalidator')
+@receiver(post_delete, sender=MenuEntry, dispatch_uid='menu_cache_invalidator')
+@receiver(node_moved, sender=MenuEntry, dispatch_uid='menu_cache_invalidator')
+def menu_cache_invalidator(**kwargs):
+	invalidate_pages()
+
+
+@receiver(bulk_updated, sender=Page, dispatch_uid='page_bulk_change_recorder')
+def page_bulk_change_recorder(pks, **kwargs):
+	for i in range(0, len(pks), 500):
+		ContentChange.record_queryset('P', Page.objects.filter(pk__in=pks[i:i + 500]).only('path'))
+
+
+@receiver(bulk_updated, sender=Page, dispatch_uid='page_bulk_cache_invalidator')
+def page_bulk_cache_invalidator(**kwargs):
+	invalidate_pages()
+
+
+@receiver(bulk_updated, sender=BlogEntry, dispatch_uid='blog_entry_bulk_change_recorder')
+def blog_entry_bulk_change_recorder(pks, **kwargs):
+	for i in range(0, len(pks), 500):
+		ContentChange.record_queryset(
+			'B', BlogEntry.objects.filter(pk__in=pks[i:i + 500]).only('created', 'slug')
+		)
+
+
+@receiver(bulk_updated, sender=BlogEntry, dispatch_uid='blog_entry_bulk_tag_counter')
+def blog_entry_bulk_tag_counter(pks, **kwargs):
+	tag_ids = set()
+	for i in range(0, len(pks), 500):
+		tag_ids.update(
+			BlogEntry.tag_set.through.objects.filter(blogentry__in=pks[i:i + 500])
+			.values_list('tag_id', flat=True)
+		)
+	Tag.update_counts(tag_ids)
+
+
+@receiver(bulk_updated, sender=BlogEntry, dispatch_uid='feed_bulk_cache_invalidator')
+def feed_bulk_cache_invalidator(**kwargs):
+	invalidate_feeds()
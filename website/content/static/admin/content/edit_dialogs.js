@@ -114,7 +114,10 @@ var ImagePicker = {
 	}
 };
 var LinkPicker = {
-	loaded: false,
+	loading: false,
+	done: false,
+	after: null,
+	prefix: '',
 	area: document.getElementById('linkarea'),
 
 	init: function() {
@@ -123,9 +126,30 @@ var LinkPicker = {
 		this.list = this.area.querySelector('select');
 	},
 	load: function() {
-		fetch('/admin/content/all_pages', {credentials: 'same-origin'}).then(function(result) {
+		// Fetch the pages a batch at a time, and only the next batch when the
+		// list is scrolled to the end, so big sites don't send every page.
+		var limit = 100;
+		if (this.loading || this.done) {
+			return;
+		}
+		this.loading = true;
+		var prefix = this.prefix;
+		var url = '/admin/content/all_pages?limit=' + limit;
+		if (prefix) {
+			url += '&prefix=' + encodeURIComponent(prefix);
+		}
+		if (this.after) {
+			url += '&after=' + this.after;
+		}
+		fetch(url, {credentials: 'same-origin'}).then(function(result) {
 			return result.json();
 		}).then(function(json) {
+			LinkPicker.loading = false;
+			if (prefix != LinkPicker.prefix) {
+				// Typed over while loading.
+				LinkPicker.load();
+				return;
+			}
 			for (var i of json) {
 				var div = document.createElement('option');
 				div.classList.add('link');
@@ -133,16 +157,42 @@ var LinkPicker = {
 				div.textContent = i.title;
 				LinkPicker.list.appendChild(div);
 			}
+			LinkPicker.done = json.length < limit;
+			if (json.length) {
+				LinkPicker.after = json[json.length - 1].cursor;
+			}
+			LinkPicker.loadIfShort();
+		}, function() {
+			LinkPicker.loading = false;
 		});
 	},
+	loadIfShort: function() {
+		// Until the list fills its box, there's no scrolling to load more.
+		var list = this.list;
+		if (this.area.style.display == 'none') {
+			return;
+		}
+		if (list.scrollTop + list.clientHeight >= list.scrollHeight - list.clientHeight) {
+			this.load();
+		}
+	},
+	filter: function(prefix) {
+		// Only the pages under the URL typed so far.
+		prefix = prefix.charAt(0) == '/' && prefix != '/' ? prefix : '';
+		if (prefix == this.prefix) {
+			return;
+		}
+		this.prefix = prefix;
+		this.after = null;
+		this.done = false;
+		this.list.textContent = '';
+		this.load();
+	},
 	show: function() {
 		PickerBackground.show();
 		this.area.style.display = null;
 		this.list.focus();
-
-		if (!this.loaded) {
-			this.load();
-		}
+		this.loadIfShort();
 	},
 	hide: function() {
 		this.area.style.display = 'none';
@@ -242,6 +292,12 @@ LinkPicker.list.onchange = function() {
 	LinkPicker.form.href.value = this.value;
 	LinkPicker.submitButton.disabled = false;
 };
+LinkPicker.list.onscroll = function() {
+	LinkPicker.loadIfShort();
+};
+LinkPicker.form.href.oninput = function() {
+	LinkPicker.filter(this.value);
+};
 LinkPicker.form.onsubmit = function() {
 	try {
 		Edit.Actions.linkAction({
@@ -259,6 +315,7 @@ LinkPicker.form.onreset = function() {
 	LinkPicker.hide();
 	LinkPicker.list.selectedIndex = -1;
 	LinkPicker.submitButton.disabled = true;
+	LinkPicker.filter('');
 	setTimeout(function() {
 		Edit.currentWindow.focus();
 	}, 0);
@@ -0,0 +1,17 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from content.models import Tag
+from content.responsive import add_srcset
+
+register = template.Library()
+
+
+@register.simple_tag
+def blog_tags():
+	return Tag.objects.filter(entry_count__gt=0)
+
+
+@register.filter
+def responsive_images(html):
+	return mark_safe(add_srcset(html))
@@ -1,10 +1,51 @@
 from datetime import timedelta
+from io import BytesIO
+import json, os, shutil, tempfile
 
 from django.contrib.auth.models import User
-from django.test import Client, TestCase
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.template import Context, Template
+from django.test import Client, RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.utils.timezone import now
+from django.utils.six import StringIO
 
-from content.models import Page
+from easy_thumbnails.alias import aliases
+from easy_thumbnails.models import Source, Thumbnail
+from PIL import Image as PILImage
+
+from content.cache import get_cached_diff
+from content.delta import SNAPSHOT_INTERVAL, apply_delta, make_delta
+from content.diff import DiffTooLarge, get_opcodes, make_table
+from content import images, search, thumbnails
+from content.images import rescan as rescan_images
+from content.models import BlogEntry, ContentChange, MediaImage, MenuEntry, Page, PageHistory, Tag
+from content.responsive import add_srcset, find_images, get_images_signature
+from website import settings
+
+# Holds the templates the test pages use, in place of the site's own media.
+TEST_MEDIA_ROOT = os.path.join(os.path.dirname(__file__), 'test_media')
+_test_media = override_settings(
+	MEDIA_ROOT=TEST_MEDIA_ROOT,
+	TEMPLATES=[dict(settings.TEMPLATES[0], DIRS=[os.path.join(TEST_MEDIA_ROOT, 'templates')])],
+)
+_old_media_root = []
+
+
+def setUpModule():
+	_test_media.enable()
+	_old_media_root.append(settings.MEDIA_ROOT)
+	settings.MEDIA_ROOT = TEST_MEDIA_ROOT
+
+
+def tearDownModule():
+	settings.MEDIA_ROOT = _old_media_root.pop()
+	_test_media.disable()
 
 
 class PageTestCase(TestCase):
@@ -45,6 +86,39 @@ class PageTestCase(TestCase):
 		self.assertEqual(one.get_absolute_url(), '/one')
 		self.assertEqual(two.get_absolute_url(), '/one/two')
 
+	def test_url_rename(self):
+		one = Page.objects.get(alias='one')
+		two = Page.objects.get(alias='two')
+		two.parent = one
+		two.save(update_fields=['parent'])
+
+		one.alias = 'uno'
+		one.save()
+		two.refresh_from_db()
+		self.assertEqual(one.get_absolute_url(), '/uno')
+		self.assertEqual(two.get_absolute_url(), '/uno/two')
+
+		with self.assertNumQueries(0):
+			two.get_absolute_url()
+
+	def test_long_path(self):
+		parent = None
+		for a in ['a' * 200, 'b' * 200, 'c' * 200]:
+			page = Page.objects.get(alias='two')
+			page.pk = None
+			page.alias = a
+			page.parent = parent
+			page.save()
+			parent = page
+		self.assertEqual(len(page.get_absolute_url()), 603)
+		self.assertEqual(Client().get(page.get_absolute_url()).status_code, 200)
+
+	def test_home_parent(self):
+		home = Page.objects.get(alias='home')
+		home.parent = Page.objects.get(alias='one')
+		with self.assertRaises(ValidationError):
+			home.full_clean()
+
 	def _test_client(self, logged_in=False):
 		client = Client()
 		if logged_in:
@@ -65,8 +139,7 @@ class PageTestCase(TestCase):
 		self.assertEqual(response.status_code, 404)
 
 		response = client.get('/four/two')
-		self.assertEqual(response.status_code, 302)
-		self.assertEqual(response['Location'], '/two')
+		self.assertEqual(response.status_code, 404)
 
 		one = Page.objects.get(alias='one')
 		for s in ['D', 'A']:
@@ -85,8 +158,16 @@ class PageTestCase(TestCase):
 		self.assertEqual(response['Location'], '/one/two')
 
 		response = client.get('/four/two')
+		self.assertEqual(response.status_code, 404)
+
+		two.parent = None
+		two.save(update_fields=['parent'])
+
+		response = client.get('/two')
+		self.assertEqual(response.status_code, 200)
+		response = client.get('/one/two')
 		self.assertEqual(response.status_code, 302)
-		self.assertEqual(response['Location'], '/one/two')
+		self.assertEqual(response['Location'], '/two')
 
 	def test_client(self):
 		self._test_client(True)
@@ -123,6 +204,1020 @@ class PageTestCase(TestCase):
 		self.assertEqual(second.modifier, me)
 
 
+class DeltaHistoryTestCase(TestCase):
+	def setUp(self):
+		self.me = User.objects.create_superuser(username='me', email=None, password='me')
+		self.page = Page.objects.create(
+			alias='one',
+			title='Test',
+			content='line 0\n',
+			modified=now(),
+			modifier=self.me,
+			status='P',
+			template='test.html',
+		)
+
+	def _save(self, count):
+		for i in range(1, count + 1):
+			self.page.content += 'line %d\n' % i
+			self.page.save()
+
+	def test_delta(self):
+		for base, text in [
+			('', 'a\nb'), ('a\nb\nc\n', 'a\nc\n'), ('a\r\nb', 'x\r\nb\r\n'), ('a', ''),
+		]:
+			self.assertEqual(apply_delta(base, make_delta(base, text)), text)
+
+	def test_chains(self):
+		self._save(SNAPSHOT_INTERVAL + 2)
+		revisions = list(PageHistory.objects.filter(page=self.page).order_by('pk'))
+		self.assertEqual(
+			[r.chain_length for r in revisions],
+			list(range(SNAPSHOT_INTERVAL)) + [0, 1, 2]
+		)
+		self.assertIsNone(revisions[SNAPSHOT_INTERVAL].base_id)
+		# Deltas only hold what changed.
+		self.assertNotIn('line 0', revisions[5].stored_content)
+
+		for i, revision in enumerate(PageHistory.objects.filter(page=self.page).order_by('pk')):
+			expected = ''.join('line %d\n' % n for n in range(i + 1))
+			self.assertEqual(revision.content, expected)
+
+	def test_unchanged(self):
+		self.page.save()
+		self.page.template = 'fruity.html'
+		self.page.save()
+		self.assertEqual(self.page.revisions.count(), 1)
+		self.page.title = 'Changed'
+		self.page.save()
+		self.assertEqual(self.page.revisions.count(), 2)
+		self.assertEqual(self.page.revisions.last().content_hash, self.page.content_hash)
+
+	def test_delete_base(self):
+		self._save(3)
+		revisions = list(PageHistory.objects.filter(page=self.page).order_by('pk'))
+		revisions[1].delete()
+		for i in (0, 2, 3):
+			revision = PageHistory.objects.get(pk=revisions[i].pk)
+			self.assertEqual(revision.content, ''.join('line %d\n' % n for n in range(i + 1)))
+		self.assertIsNone(PageHistory.objects.get(pk=revisions[2].pk).base_id)
+
+	def test_compact_history(self):
+		self._save(SNAPSHOT_INTERVAL + 5)
+		revisions = list(PageHistory.objects.filter(page=self.page).order_by('pk'))
+		draft = PageHistory.objects.create(
+			page=self.page, type='D', title='Test', content='draft\n', modifier=self.me
+		)
+		self._save(1)
+		texts = dict((r.pk, r.content) for r in PageHistory.objects.all())
+		# Spread the old ones over two days, months ago.
+		for i, revision in enumerate(revisions):
+			PageHistory.objects.filter(pk=revision.pk).update(
+				modified=now() - timedelta(days=100 + i % 2)
+			)
+
+		call_command('compact_history', stdout=open(os.devnull, 'w'))
+		left = list(PageHistory.objects.order_by('pk'))
+		# The last of each day, the one the draft was started from, the draft
+		# and the newest.
+		self.assertEqual(
+			[r.pk for r in left],
+			sorted(set([revisions[-2].pk, revisions[-1].pk, draft.pk])) + [left[-1].pk]
+		)
+		self.assertEqual(len(left), 4)
+		for revision in left:
+			self.assertEqual(revision.content, texts[revision.pk])
+
+	def test_publish_scheduled(self):
+		due = PageHistory.objects.create(
+			page=self.page, type='F', title='Due', content='due\n', modifier=self.me
+		)
+		later = PageHistory.objects.create(
+			page=self.page, type='F', title='Later', content='later\n', modifier=self.me
+		)
+		PageHistory.objects.filter(pk=due.pk).update(modified=now() - timedelta(minutes=1))
+		PageHistory.objects.filter(pk=later.pk).update(modified=now() + timedelta(days=1))
+
+		call_command('publish_scheduled', once=True, stdout=open(os.devnull, 'w'))
+		page = Page.objects.get(pk=self.page.pk)
+		self.assertEqual(page.title, 'Due')
+		self.assertEqual(page.content, 'due\n')
+		self.assertEqual(PageHistory.objects.get(pk=due.pk).type, 'H')
+		self.assertEqual(PageHistory.objects.get(pk=later.pk).type, 'F')
+		# No extra revision for the page save.
+		self.assertEqual(page.revisions.count(), 3)
+
+	def test_draft(self):
+		self._save(1)
+		draft = PageHistory.objects.create(
+			page=self.page, type='D', title='Test', content='draft\n', modifier=self.me
+		)
+		self.assertIsNone(draft.base_id)
+		self.assertEqual(draft.stored_content, 'draft\n')
+		draft.make_current(self.me)
+		self.assertEqual(PageHistory.objects.get(pk=draft.pk).content, 'draft\n')
+
+
+class DiffTestCase(TestCase):
+	def test_diff(self):
+		old = '\n'.join('line %d' % i for i in range(50))
+		new = old.replace('line 20', 'line 20!')
+		self.assertEqual(get_opcodes(old.splitlines(), new.splitlines()), [
+			('equal', 0, 20, 0, 20), ('replace', 20, 21, 20, 21), ('equal', 21, 50, 21, 50),
+		])
+		table = make_table(old, new)
+		self.assertEqual(table.count('<tr>'), 9)
+		self.assertIn('line 20<span class="diff_add">!</span>', table)
+
+		new = '\n'.join('other %d' % i for i in range(50))
+		with self.assertRaises(DiffTooLarge):
+			get_opcodes(old.splitlines(), new.splitlines(), max_cost=10)
+		self.assertEqual(make_table(old, old), make_table(old + '\n', old))
+
+
+class PageCacheTestCase(TestCase):
+	def setUp(self):
+		cache.clear()
+		me = User.objects.create_superuser(username='me', email=None, password='me')
+		self.page = Page.objects.create(
+			alias='one',
+			title='Test',
+			content='one',
+			modified=now(),
+			modifier=me,
+			status='P',
+			template='test.html',
+		)
+
+	def test_cache_hit(self):
+		client = Client()
+		response = client.get('/one')
+		self.assertContains(response, 'one')
+
+		with self.assertNumQueries(0):
+			response = client.get('/one')
+		self.assertContains(response, 'one')
+
+	def test_invalidation(self):
+		client = Client()
+		client.get('/one')
+
+		self.page.content = 'changed'
+		self.page.save()
+		self.assertContains(client.get('/one'), 'changed')
+
+		client.login(username='me', password='me')
+		client.post('/admin/content/page/', data={
+			'action': 'change_status',
+			'action-status': 'D',
+			'_selected_action': [self.page.pk],
+		})
+		client.logout()
+		self.assertEqual(client.get('/one').status_code, 404)
+
+
+class ConditionalGetTestCase(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.me = User.objects.create_superuser(username='me', email=None, password='me')
+		self.page = Page.objects.create(
+			alias='one',
+			title='Test',
+			content='one',
+			modified=now(),
+			modifier=self.me,
+			status='P',
+			template='test.html',
+		)
+		self.entry = BlogEntry.objects.create(
+			modifier=self.me,
+			slug='test',
+			title='Test',
+			content='entry',
+			status='P',
+		)
+
+	def _test_revalidation(self, url, change):
+		client = Client()
+		response = client.get(url)
+		self.assertEqual(response.status_code, 200)
+		etag = response['ETag']
+
+		response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 304)
+		if response.has_header('Last-Modified'):
+			response = client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+			self.assertEqual(response.status_code, 304)
+
+		change()
+		response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 200)
+		self.assertNotEqual(response['ETag'], etag)
+
+	def test_page(self):
+		def change():
+			self.page.content = 'changed'
+			self.page.save()
+		self._test_revalidation('/one', change)
+
+	def test_blog_entry(self):
+		def change():
+			self.entry.content = 'changed'
+			self.entry.save()
+		self._test_revalidation(self.entry.get_absolute_url(), change)
+
+	def test_feed(self):
+		client = Client(HTTP_HOST='testserver')
+		response = client.get('/news?atom')
+		self.assertContains(response, '<title>Test</title>')
+		etag = response['ETag']
+
+		with self.assertNumQueries(0):
+			response = client.get('/news?atom', HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 304)
+
+		response = client.get('/news?atom', HTTP_ACCEPT_ENCODING='gzip')
+		self.assertEqual(response['Content-Encoding'], 'gzip')
+		self.assertEqual(response['ETag'], etag[:-1] + '-gzip"')
+		response = client.get(
+			'/news?atom', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag']
+		)
+		self.assertEqual(response.status_code, 304)
+		self.assertEqual(client.get('/news?atom', HTTP_HOST='evil.example').status_code, 400)
+
+		self.entry.title = 'Changed'
+		self.entry.save()
+		response = client.get('/news?atom', HTTP_IF_NONE_MATCH=etag)
+		self.assertContains(response, '<title>Changed</title>')
+
+	def test_blog_list(self):
+		def change():
+			BlogEntry.objects.create(
+				modifier=self.me,
+				slug='another',
+				title='Another',
+				content='another',
+				status='P',
+			)
+		self._test_revalidation('/news', change)
+
+	def test_blog_list_delete(self):
+		client = Client()
+		response = client.get('/news')
+		self.assertFalse(response.has_header('Last-Modified'))
+		etag = response['ETag']
+		self.entry.delete()
+		response = client.get('/news', HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 200)
+		self.assertNotContains(response, 'entry')
+
+
+class AllPagesTestCase(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.me = User.objects.create_superuser(username='me', email=None, password='me')
+		self.client.login(username='me', password='me')
+		for a in ['home', 'b', 'a', 'c']:
+			Page.objects.create(
+				alias=a,
+				title=a.upper(),
+				content=a,
+				modified=now(),
+				modifier=self.me,
+				status='P',
+				template='test.html',
+			)
+
+	def _get(self, url, **kwargs):
+		response = self.client.get(url, **kwargs)
+		if response.streaming:
+			return response, json.loads(b''.join(response.streaming_content))
+		return response, json.loads(response.content) if response.content else None
+
+	def test_list(self):
+		response, pages = self._get('/admin/content/all_pages')
+		# In tree order, and each page is a tree of its own here.
+		self.assertEqual([p['url'] for p in pages], ['/', '/b', '/a', '/c'])
+		a = Page.objects.get(alias='a')
+		self.assertEqual(pages[2], {
+			'url': '/a', 'title': 'A', 'status': 'P', 'cursor': '%d-%d' % (a.tree_id, a.lft)
+		})
+
+		response, pages = self._get('/admin/content/all_pages?limit=2')
+		self.assertEqual([p['url'] for p in pages], ['/', '/b'])
+		response, pages = self._get('/admin/content/all_pages?limit=2&after=' + pages[-1]['cursor'])
+		self.assertEqual([p['url'] for p in pages], ['/a', '/c'])
+		response, pages = self._get('/admin/content/all_pages?after=' + pages[-1]['cursor'])
+		self.assertEqual(pages, [])
+		response, pages = self._get('/admin/content/all_pages?prefix=/c')
+		self.assertEqual([p['url'] for p in pages], ['/c'])
+		self.assertEqual(self.client.get('/admin/content/all_pages?after=1').status_code, 400)
+
+		# Children come after their parent, and before the next tree.
+		Page.objects.create(
+			alias='a1',
+			parent=a,
+			title='A1',
+			content='a1',
+			modified=now(),
+			modifier=self.me,
+			status='P',
+			template='test.html',
+		)
+		response, pages = self._get('/admin/content/all_pages')
+		self.assertEqual([p['url'] for p in pages], ['/', '/b', '/a', '/a/a1', '/c'])
+		response, pages = self._get('/admin/content/all_pages?after=' + pages[2]['cursor'])
+		self.assertEqual([p['url'] for p in pages], ['/a/a1', '/c'])
+
+	def test_cache(self):
+		response, pages = self._get('/admin/content/all_pages')
+		etag = response['ETag']
+		self.assertEqual(
+			self.client.get('/admin/content/all_pages', HTTP_IF_NONE_MATCH=etag).status_code, 304
+		)
+		response, cached = self._get('/admin/content/all_pages')
+		self.assertFalse(response.streaming)
+		self.assertEqual(cached, pages)
+
+		page = Page.objects.get(alias='a')
+		page.title = 'Changed'
+		page.save()
+		response, pages = self._get('/admin/content/all_pages', HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(pages[2]['title'], 'Changed')
+
+
+class ImageIndexTestCase(TestCase):
+	def setUp(self):
+		self.me = User.objects.create_superuser(username='me', email=None, password='me')
+		self.client.login(username='me', password='me')
+		self.media_root = tempfile.mkdtemp()
+		self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+		self.settings_override.enable()
+		self.old_settings = settings.MEDIA_ROOT, settings.THUMBNAIL_WORKERS
+		settings.MEDIA_ROOT = self.media_root
+		settings.THUMBNAIL_WORKERS = 0
+		os.makedirs(os.path.join(self.media_root, 'images', 'sub'))
+		self._make_image('images/a.png', (40, 30))
+		self._make_image('images/sub/b.png', (20, 10))
+		with open(os.path.join(self.media_root, 'images', 'c.svg'), 'w') as f:
+			f.write('<svg xmlns="http://www.w3.org/2000/svg"/>')
+
+	def tearDown(self):
+		settings.MEDIA_ROOT, settings.THUMBNAIL_WORKERS = self.old_settings
+		self.settings_override.disable()
+		shutil.rmtree(self.media_root)
+
+	def _make_image(self, path, size):
+		PILImage.new('RGB', size).save(os.path.join(self.media_root, path))
+
+	def _tree(self):
+		return json.loads(self.client.get('/admin/content/all_images').content)
+
+	def test_rescan(self):
+		call_command('index_images', stdout=open(os.devnull, 'w'))
+		tree = self._tree()
+		self.assertEqual(tree['images'], [
+			{'url': '/media/images/a.png', 'width': 40, 'height': 30},
+			{'url': '/media/images/c.svg', 'thumb': '/media/images/c.svg'},
+		])
+		self.assertEqual(tree['folders'][0]['path'], 'sub')
+		self.assertEqual(tree['folders'][0]['images'][0]['url'], '/media/images/sub/b.png')
+
+		os.unlink(os.path.join(self.media_root, 'images', 'c.svg'))
+		self._make_image('images/a.png', (50, 30))
+		os.utime(os.path.join(self.media_root, 'images', 'a.png'), (0, 0))
+		self.assertEqual(rescan_images(), (0, 1, 1))
+		self.assertEqual(self._tree()['images'], [
+			{'url': '/media/images/a.png', 'width': 50, 'height': 30},
+		])
+
+		response = self.client.get('/admin/content/get_thumbnail?f=images/a.png&s=smallthumb')
+		self.assertEqual(response.status_code, 302)
+		self.assertEqual(self._tree()['images'][0]['thumb'], response['Location'])
+
+	def test_file_browser(self):
+		rescan_images()
+		data = BytesIO()
+		PILImage.new('RGB', (8, 8)).save(data, 'PNG')
+		upload = SimpleUploadedFile('new.png', data.getvalue(), content_type='image/png')
+		self.client.post('/admin/content/images/', {'upload': upload})
+		new = MediaImage.objects.get(path='images/new.png')
+		self.assertEqual(sorted(new.get_thumbnails()), ['smallthumb', 'thumb'])
+		for name in new.get_thumbnails().values():
+			self.assertTrue(os.path.exists(os.path.join(self.media_root, name)))
+		# a.png was only indexed, so it has no thumbnails yet.
+		response = self.client.get('/admin/content/images/')
+		self.assertContains(response, 'Making thumbnails for <span>1</span> image&hellip;')
+		self.assertContains(response, '<div class="image pending">', count=1)
+		self.client.post('/admin/content/images/', {
+			'action': 'delete_selected', '_selected_action': ['a.png'],
+		})
+		self.client.post('/admin/content/images/', {
+			'action': 'move_selected', 'action-destination': 'sub', '_selected_action': ['new.png'],
+		})
+		self.assertEqual(
+			sorted(MediaImage.objects.values_list('path', flat=True)),
+			['images/c.svg', 'images/sub/b.png', 'images/sub/new.png']
+		)
+		self.assertEqual(rescan_images(), (0, 0, 0))
+
+	def test_make_thumbnails(self):
+		rescan_images()
+		settings.THUMBNAIL_WORKERS = 1
+		thumbnails.enqueue(['images/a.png', 'images/c.svg'])
+		self.assertEqual(list(MediaImage.objects.filter(pending=True)), [MediaImage.objects.get(path='images/a.png')])
+		self.assertEqual(MediaImage.objects.get(path='images/a.png').get_thumbnails(), {})
+
+		# Claimed by a command that then died, so it's still pending...
+		self.assertEqual(thumbnails.take_pending(10), ['images/a.png'])
+		self.assertEqual(thumbnails.take_pending(10), [])
+		self.assertTrue(MediaImage.objects.get(path='images/a.png').pending)
+		# ...and taken on again once the claim is old.
+		MediaImage.objects.filter(path='images/a.png').update(claimed=now() - timedelta(hours=1))
+		self.assertEqual(thumbnails.take_pending(10), ['images/a.png'])
+		# Enqueued again while being made, so made again.
+		thumbnails.enqueue(['images/a.png'])
+		thumbnails.finish_pending('images/a.png')
+		self.assertTrue(MediaImage.objects.get(path='images/a.png').pending)
+
+		out = StringIO()
+		call_command('make_thumbnails', once=True, jobs=0, stdout=out)
+		self.assertEqual(out.getvalue(), '1 images done, 0 failed.\n')
+		image = MediaImage.objects.get(path='images/a.png')
+		self.assertFalse(image.pending)
+		self.assertEqual(thumbnails.get_missing_aliases(image), [])
+
+	def test_get_thumbnail(self):
+		url = '/admin/content/get_thumbnail?f=%s&s=%s'
+		self.assertEqual(self.client.get(url % ('images/a.png', 'huge')).status_code, 404)
+		self.assertEqual(self.client.get(url % ('images/../../a.png', 'thumb')).status_code, 404)
+		self.assertEqual(self.client.get(url % ('images/d.png', 'thumb')).status_code, 404)
+
+		# Someone else is making it.
+		image = images.index_image('images/a.png')
+		lock_path = thumbnails._get_lock_path(image.path, 'thumb')
+		token = thumbnails._lock(lock_path)
+		self.assertIsNotNone(token)
+		self.assertIsNone(thumbnails._lock(lock_path))
+		self.assertIsNone(thumbnails.make_thumbnail(image, 'thumb'))
+		self.assertIsNone(thumbnails.make_thumbnail(image, 'thumb', wait=0.2))
+		settings.THUMBNAIL_WAIT = 0.2
+		try:
+			response = self.client.get(url % ('images/a.png', 'thumb'))
+		finally:
+			settings.THUMBNAIL_WAIT = 5
+		self.assertEqual(response['Location'], '/media/images/a.png')
+		self.assertTrue(os.path.exists(lock_path))
+		# Until they've taken too long.
+		os.utime(lock_path, (0, 0))
+		new_token = thumbnails._lock(lock_path)
+		self.assertIsNotNone(new_token)
+		# The lock isn't theirs anymore, so they leave it be.
+		thumbnails._unlock(lock_path, token)
+		self.assertTrue(os.path.exists(lock_path))
+		thumbnails._unlock(lock_path, new_token)
+		self.assertFalse(os.path.exists(lock_path))
+
+		response = self.client.get(url % ('images/a.png', 'thumb'))
+		image.refresh_from_db()
+		self.assertEqual(response['Location'], '/media/' + image.get_thumbnails()['thumb'])
+		# Once it's indexed the image itself isn't needed.
+		os.unlink(os.path.join(self.media_root, 'images', 'a.png'))
+		self.assertEqual(self.client.get(url % ('images/a.png', 'thumb'))['Location'], response['Location'])
+
+		settings.THUMBNAIL_WAIT = 0
+		try:
+			response = self.client.get(url % ('images/sub/b.png', 'thumb'))
+		finally:
+			settings.THUMBNAIL_WAIT = 5
+		self.assertEqual(response['Location'], '/media/images/sub/b.png')
+		# Made in the background, which here means straight away.
+		self.assertIn('thumb', MediaImage.objects.get(path='images/sub/b.png').get_thumbnails())
+
+
+	def test_regenerate_thumbnails(self):
+		rescan_images()
+		call_command('regenerate_thumbnails', jobs=0, stdout=open(os.devnull, 'w'))
+		image = MediaImage.objects.get(path='images/a.png')
+		self.assertEqual(thumbnails.get_missing_aliases(image), [])
+		old = image.get_thumbnails()['thumb']
+
+		new_aliases = dict(settings.THUMBNAIL_ALIASES)
+		new_aliases[''] = dict(new_aliases[''], thumb={'size': (100, 80), 'crop': True})
+		try:
+			with override_settings(THUMBNAIL_ALIASES=new_aliases):
+				aliases.populate_from_settings()
+				self.assertEqual(thumbnails.get_stale_aliases(image), ['thumb'])
+				out = StringIO()
+				call_command('regenerate_thumbnails', jobs=0, stdout=out)
+				self.assertEqual(out.getvalue(), '2 images done, 0 failed.\n')
+				image.refresh_from_db()
+				self.assertNotEqual(image.get_thumbnails()['thumb'], old)
+				self.assertEqual(thumbnails.get_stale_aliases(image), [])
+				self.assertEqual(thumbnails.get_missing_aliases(image), [])
+		finally:
+			aliases.populate_from_settings()
+		self.assertEqual(thumbnails.get_stale_aliases(image), ['thumb'])
+
+		out = StringIO()
+		call_command('regenerate_thumbnails', jobs=0, dry_run=True, stdout=out)
+		self.assertEqual(out.getvalue(), '2 images need thumbnails.\n')
+
+	def test_dead_worker(self):
+		def generate_thumbnails(path):
+			if path == 'dead':
+				# As if killed for running out of memory.
+				os._exit(1)
+			return path
+
+		old = thumbnails.generate_thumbnails
+		thumbnails.generate_thumbnails = generate_thumbnails
+		try:
+			results = list(thumbnails.generate_all(['dead', 'alive'], jobs=1, timeout=2))
+		finally:
+			thumbnails.generate_thumbnails = old
+		self.assertEqual(results, [
+			('dead', 'Not done within 2 seconds, or its worker died.'), ('alive', None),
+		])
+
+
+	def test_clean_thumbnails(self):
+		rescan_images()
+		call_command('regenerate_thumbnails', jobs=0, stdout=open(os.devnull, 'w'))
+		old = MediaImage.objects.get(path='images/a.png').get_thumbnails()
+		self.client.post('/admin/content/images/', {
+			'action': 'move_selected', 'action-destination': 'sub', '_selected_action': ['a.png'],
+		})
+		moved = MediaImage.objects.get(path='images/sub/a.png').get_thumbnails()
+		self.assertEqual(sorted(moved), ['smallthumb', 'thumb'])
+		for alias, name in moved.items():
+			self.assertEqual(name, old[alias].replace('images/', 'images/sub/'))
+			self.assertTrue(os.path.exists(os.path.join(self.media_root, name)))
+			self.assertFalse(os.path.exists(os.path.join(self.media_root, old[alias])))
+		self.assertEqual(Thumbnail.objects.filter(source__name='images/sub/a.png').count(), 2)
+		self.assertFalse(Source.objects.filter(name='images/a.png').exists())
+
+		self.client.post('/admin/content/images/sub/', {
+			'action': 'delete_selected', '_selected_action': ['a.png'],
+		})
+		for name in moved.values():
+			self.assertFalse(os.path.exists(os.path.join(self.media_root, name)))
+		self.assertFalse(Source.objects.filter(name='images/sub/a.png').exists())
+
+		# Removed behind the admin's back.
+		b = MediaImage.objects.get(path='images/sub/b.png').get_thumbnails()
+		os.unlink(os.path.join(self.media_root, 'images', 'sub', 'b.png'))
+		os.unlink(os.path.join(self.media_root, b['thumb']))
+		stray = os.path.join(self.media_root, 'thumbnails', 'images', 'gone.png.10x10_q85.png')
+		open(stray, 'w').close()
+		out = StringIO()
+		call_command('clean_thumbnails', dry_run=True, stdout=out)
+		self.assertEqual(out.getvalue(), '2 files and 3 database rows would be removed.\n')
+		call_command('clean_thumbnails', stdout=open(os.devnull, 'w'))
+		self.assertFalse(os.path.exists(stray))
+		self.assertFalse(os.path.exists(os.path.join(self.media_root, b['smallthumb'])))
+		self.assertFalse(Thumbnail.objects.exists())
+		self.assertFalse(Source.objects.exists())
+
+	def test_clean_stale_thumbnails(self):
+		rescan_images()
+		call_command('regenerate_thumbnails', jobs=0, stdout=open(os.devnull, 'w'))
+		made = MediaImage.objects.get(path='images/a.png').get_thumbnails()
+		# Made for options that have since changed.
+		stale = 'thumbnails/images/a.png.10x10_q85.png'
+		PILImage.new('RGB', (10, 10)).save(os.path.join(self.media_root, stale))
+		os.utime(os.path.join(self.media_root, stale), (0, 0))
+		source = Source.objects.get(name='images/a.png')
+		Thumbnail.objects.create(source=source, storage_hash=source.storage_hash, name=stale)
+		# Not in the index yet.
+		new = 'thumbnails/images/a.png.20x20_q85.png'
+		PILImage.new('RGB', (20, 20)).save(os.path.join(self.media_root, new))
+
+		out = StringIO()
+		call_command('clean_thumbnails', dry_run=True, stdout=out)
+		self.assertEqual(out.getvalue(), '1 files and 1 database rows would be removed.\n')
+		call_command('clean_thumbnails', stdout=open(os.devnull, 'w'))
+		self.assertFalse(os.path.exists(os.path.join(self.media_root, stale)))
+		self.assertFalse(Thumbnail.objects.filter(name=stale).exists())
+		self.assertTrue(os.path.exists(os.path.join(self.media_root, new)))
+		for name in made.values():
+			self.assertTrue(os.path.exists(os.path.join(self.media_root, name)))
+			self.assertTrue(Thumbnail.objects.filter(name=name).exists())
+		self.assertEqual(MediaImage.objects.get(path='images/a.png').get_thumbnails(), made)
+
+
+	def test_responsive_images(self):
+		self._make_image('images/big.jpg', (1000, 500))
+		rescan_images()
+		thumbnails.enqueue(['images/big.jpg'])
+		made = MediaImage.objects.get(path='images/big.jpg').get_thumbnails()
+		self.assertEqual(sorted(made), ['smallthumb', 'thumb', 'w480', 'w960'])
+		self.assertTrue(made['w480'].endswith('.webp'))
+		self.assertEqual(PILImage.open(os.path.join(self.media_root, made['w480'])).size, (480, 240))
+
+		html = (
+			'<p><img src="/media/images/big.jpg" alt="Big"> <img src="/media/images/a.png" width="20"/>'
+			'<img src="/static/logo.png"></p>'
+		)
+		self.assertEqual(add_srcset(html), (
+			'<p><picture><source type="image/webp" srcset="/media/%s 480w, /media/%s 960w, '
+			'/media/images/big.jpg 1000w" sizes="(max-width: 1000px) 100vw, 1000px">'
+			'<img src="/media/images/big.jpg" alt="Big" width="1000" height="500" loading="lazy">'
+			'</picture> <img src="/media/images/a.png" width="20" loading="lazy" />'
+			'<img src="/static/logo.png"></p>'
+		) % (made['w480'], made['w960']))
+		# The images can be looked up once for both.
+		found = find_images(html)
+		signature = get_images_signature(html)
+		with self.assertNumQueries(0):
+			self.assertEqual(get_images_signature(html, found), signature)
+			add_srcset(html, found)
+
+		# Cached until the image changes, e.g. in the process that makes variants.
+		image = MediaImage.objects.get(path='images/big.jpg')
+		signature = get_images_signature(html)
+		del made['w960']
+		image.set_thumbnails(made)
+		image.save()
+		self.assertNotEqual(get_images_signature(html), signature)
+		self.assertIn('srcset="/media/%s 480w, /media/images/big.jpg 1000w"' % made['w480'], add_srcset(html))
+
+		self.client.post('/admin/content/images/', {
+			'action': 'delete_selected', '_selected_action': ['big.jpg'],
+		})
+		self.assertEqual(add_srcset('<img src="/media/images/big.jpg">'), '<img src="/media/images/big.jpg">')
+
+
+class BlogTagTestCase(TestCase):
+	def setUp(self):
+		self.me = User.objects.create_superuser(username='me', email=None, password='me')
+
+	def _create_entry(self, slug, tags, status='P'):
+		return BlogEntry.objects.create(
+			modifier=self.me,
+			slug=slug,
+			title=slug,
+			content=slug,
+			tags=tags,
+			status=status,
+		)
+
+	def _counts(self):
+		return dict(Tag.objects.values_list('name', 'entry_count'))
+
+	def test_tag_set(self):
+		one = self._create_entry('one', 'a b')
+		self._create_entry('two', 'b c', status='D')
+		self.assertEqual(self._counts(), {'a': 1, 'b': 1, 'c': 0})
+
+		one.tags = 'b'
+		one.save()
+		self.assertEqual(self._counts(), {'a': 0, 'b': 1, 'c': 0})
+		self.assertEqual([t.name for t in one.tag_set.all()], ['b'])
+
+		BlogEntry.objects.get(slug='two').delete()
+		self.assertEqual(self._counts(), {'a': 0, 'b': 1, 'c': 0})
+
+		one.delete()
+		self.assertEqual(self._counts(), {'a': 0, 'b': 0, 'c': 0})
+
+	def test_tag_list(self):
+		self._create_entry('one', 'a b')
+		self._create_entry('two', 'b')
+		self._create_entry('three', 'ab')
+
+		client = Client()
+		response = client.get('/news/tag/b')
+		self.assertEqual(
+			sorted(e.slug for e in response.context['entries']), ['one', 'two']
+		)
+		response = client.get('/news/tag/a')
+		self.assertEqual([e.slug for e in response.context['entries']], ['one'])
+
+	def test_make_published(self):
+		entry = self._create_entry('one', 'a', status='D')
+		self.assertEqual(self._counts(), {'a': 0})
+
+		client = Client()
+		client.login(username='me', password='me')
+		client.post('/admin/content/blogentry/', data={
+			'action': 'make_published',
+			'_selected_action': [entry.pk],
+		})
+		self.assertEqual(self._counts(), {'a': 1})
+
+
+class BlogPaginationTestCase(TestCase):
+	def setUp(self):
+		me = User.objects.create_superuser(username='me', email=None, password='me')
+		start = now()
+		for i in range(12):
+			BlogEntry.objects.create(
+				modifier=me,
+				created=start - timedelta(days=i),
+				slug='entry-%d' % i,
+				title='Entry %d' % i,
+				content='entry',
+				status='P',
+			)
+
+	def _slugs(self, response):
+		return [e.slug for e in response.context['entries']]
+
+	def test_pages(self):
+		client = Client()
+		response = client.get('/news')
+		self.assertEqual(self._slugs(response), ['entry-%d' % i for i in range(0, 5)])
+		entries = response.context['entries']
+		self.assertFalse(entries.has_previous)
+		self.assertTrue(entries.has_next)
+
+		response = client.get('/news?' + entries.next_query())
+		self.assertEqual(self._slugs(response), ['entry-%d' % i for i in range(5, 10)])
+		second = response.context['entries']
+		self.assertTrue(second.has_previous)
+		self.assertTrue(second.has_next)
+
+		response = client.get('/news?' + second.next_query())
+		self.assertEqual(self._slugs(response), ['entry-10', 'entry-11'])
+		self.assertFalse(response.context['entries'].has_next)
+
+		response = client.get('/news?' + second.previous_query())
+		self.assertEqual(self._slugs(response), ['entry-%d' % i for i in range(0, 5)])
+		self.assertFalse(response.context['entries'].has_previous)
+
+		response = client.get('/news?before=rubbish')
+		self.assertEqual(self._slugs(response), ['entry-%d' % i for i in range(0, 5)])
+
+	def test_old_page_links(self):
+		client = Client()
+		response = client.get('/news?page=2')
+		self.assertEqual(response.status_code, 301)
+		response = client.get(response['Location'])
+		self.assertEqual(self._slugs(response), ['entry-%d' % i for i in range(5, 10)])
+
+		response = client.get('/news?page=1')
+		self.assertEqual(response.status_code, 301)
+		self.assertEqual(response['Location'], '/news')
+
+		response = client.get('/news?page=9')
+		self.assertEqual(response.status_code, 404)
+
+
+class SearchTestCase(TestCase):
+	def setUp(self):
+		self.me = User.objects.create_superuser(username='me', email=None, password='me')
+		for a, title, content, status in [
+			('apples', 'Apples', '<p>Red and <b>green</b> fruit.</p>', 'P'),
+			('pears', 'Pears', '<p>Green fruit, mentions apples.</p>', 'P'),
+			('secret', 'Secret apples', '<p>Not published.</p>', 'D'),
+		]:
+			Page.objects.create(
+				alias=a,
+				title=title,
+				content=content,
+				modified=now(),
+				modifier=self.me,
+				status=status,
+				template='test.html',
+			)
+		BlogEntry.objects.create(
+			modifier=self.me,
+			slug='news',
+			title='Green news',
+			content='<p>Nothing about fruit.</p>',
+			status='P',
+		)
+
+	def _titles(self, response):
+		return [r.title for r in response.context['results']]
+
+	def test_search(self):
+		client = Client()
+		response = client.get('/search?q=apples')
+		self.assertEqual(self._titles(response), ['Apples', 'Pears'])
+
+		response = client.get('/search?q=green')
+		self.assertEqual(sorted(self._titles(response)), ['Apples', 'Green news', 'Pears'])
+
+		response = client.get('/search?q=bold')
+		self.assertEqual(self._titles(response), [])
+		response = client.get('/search?q=%22')
+		self.assertEqual(self._titles(response), [])
+
+		page = Page.objects.get(alias='pears')
+		page.content = 'Yellow'
+		page.save()
+		response = client.get('/search?q=apples')
+		self.assertEqual(self._titles(response), ['Apples'])
+
+		page.delete()
+		response = client.get('/search?q=yellow')
+		self.assertEqual(self._titles(response), [])
+
+	def test_admin_search(self):
+		client = Client()
+		client.login(username='me', password='me')
+		response = client.get('/admin/content/page/', {'q': 'apples'})
+		self.assertEqual(
+			sorted(p.alias for p in response.context['cl'].result_list), ['apples', 'pears', 'secret']
+		)
+		# Only the alias matches.
+		response = client.get('/admin/content/page/', {'q': 'secret'})
+		self.assertEqual([p.alias for p in response.context['cl'].result_list], ['secret'])
+		response = client.get('/admin/content/page/', {'q': 'pears fruit'})
+		self.assertEqual([p.alias for p in response.context['cl'].result_list], ['pears'])
+		response = client.get('/admin/content/blogentry/', {'q': 'green'})
+		self.assertEqual([e.slug for e in response.context['cl'].result_list], ['news'])
+		response = client.get('/admin/content/blogentry/', {'q': 'news'})
+		self.assertEqual([e.slug for e in response.context['cl'].result_list], ['news'])
+
+	def test_drafts_and_limit(self):
+		for i in range(3):
+			Page.objects.create(
+				alias='draft%d' % i,
+				title='Draft apples',
+				content='apples apples apples',
+				modified=now(),
+				modifier=self.me,
+				status='D',
+				template='test.html',
+			)
+		matches = search.search('apples', limit=2, published_only=['P'])
+		self.assertEqual(
+			sorted(Page.objects.get(pk=pk).alias for kind, pk in matches), ['apples', 'pears']
+		)
+		self.assertEqual(len(search.search('apples', limit=2)), 2)
+
+
+class MenuTestCase(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.a = MenuEntry.objects.create(label='A', href='/a')
+		self.b = MenuEntry.objects.create(label='B', href='/a/b', parent=self.a)
+		self.c = MenuEntry.objects.create(label='C & D', href='/a/b/c', parent=self.b)
+		self.e = MenuEntry.objects.create(label='E', href='/e')
+
+	def _render(self, path, max_depth=None):
+		context = Context({'request': RequestFactory().get(path), 'max_depth': max_depth})
+		return Template('{% load menu %}{% menu max_depth %}').render(context)
+
+	def test_classes(self):
+		output = self._render('/a/b')
+		self.assertInHTML(
+			'<li class="prefix has_children ancestor"><a href="/a">A</a>'
+			'<ul data-depth="2"><li class="current has_children"><a href="/a/b">B</a>'
+			'<ul data-depth="3"><li class="descendant"><a href="/a/b/c">C &amp; D</a></li></ul>'
+			'</li></ul></li>',
+			output
+		)
+		self.assertInHTML('<li class=""><a href="/e">E</a></li>', output)
+		self.assertNotIn('data-depth="2"', self._render('/a/b', 1))
+
+	def test_cache(self):
+		self._render('/a/b')
+		# Only to check whether the menu has changed.
+		with self.assertNumQueries(1):
+			self._render('/a/b')
+
+		self.e.label = 'F'
+		self.e.save()
+		self.assertIn('>F</a>', self._render('/a/b'))
+
+		# As if changed by another process, whose cache this one doesn't see.
+		MenuEntry.objects.filter(pk=self.e.pk).update(label='G', modified=now())
+		self.assertIn('>G</a>', self._render('/a/b'))
+
+		MenuEntry.objects.get(pk=self.e.pk).delete()
+		self.assertNotIn('>G</a>', self._render('/a/b'))
+		MenuEntry.objects.move_node(MenuEntry.objects.get(pk=self.c.pk), MenuEntry.objects.get(pk=self.a.pk), 'right')
+		self.assertNotIn('data-depth="3"', self._render('/a/b'))
+
+
+class ExportTestCase(TestCase):
+	def setUp(self):
+		self.me = User.objects.create_superuser(username='me', email=None, password='me')
+		for a, s in [('home', 'P'), ('one', 'P'), ('two', 'D')]:
+			Page.objects.create(
+				alias=a,
+				title='Test',
+				content=a,
+				modified=now(),
+				modifier=self.me,
+				status=s,
+				template='test.html',
+			)
+		self.entry = BlogEntry.objects.create(
+			modifier=self.me,
+			slug='test',
+			title='Test',
+			content='entry',
+			tags='one two',
+			status='P',
+		)
+		self.output = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.output)
+
+	def _exported(self, name):
+		return os.path.exists(os.path.join(self.output, name))
+
+	def test_export(self):
+		call_command('export_site', self.output, jobs=1, stdout=open(os.devnull, 'w'))
+
+		self.assertTrue(self._exported('index.html'))
+		self.assertTrue(self._exported('one.html'))
+		self.assertFalse(self._exported('two.html'))
+
+		self.assertTrue(self._exported('news.html'))
+		self.assertTrue(self._exported('news.atom.xml'))
+		self.assertTrue(self._exported('news/tag/one.html'))
+		self.assertTrue(self._exported('news/tag/two.atom.xml'))
+		self.assertTrue(self._exported('news/%s.html' % self.entry.dateslug()))
+		self.assertTrue(self._exported(self.entry.get_absolute_url()[1:] + '.html'))
+
+		with open(os.path.join(self.output, 'one.html')) as f:
+			self.assertEqual(f.read(), 'Testone')
+
+	def test_index_collision(self):
+		one = Page.objects.get(alias='one')
+		one.alias = 'index'
+		one.save()
+		with self.assertRaises(CommandError):
+			call_command('export_site', self.output, jobs=1, stdout=open(os.devnull, 'w'))
+		self.assertFalse(self._exported('index.html'))
+
+	def test_incremental_export(self):
+		def export():
+			call_command(
+				'export_site', self.output, jobs=1, incremental=True,
+				stdout=open(os.devnull, 'w'), stderr=open(os.devnull, 'w')
+			)
+
+		def read(name):
+			with open(os.path.join(self.output, name)) as f:
+				return f.read()
+
+		export()
+		with open(os.path.join(self.output, 'index.html'), 'w') as f:
+			f.write('untouched')
+
+		one = Page.objects.get(alias='one')
+		one.content = 'changed'
+		one.save()
+		export()
+		self.assertEqual(read('one.html'), 'Testchanged')
+		self.assertEqual(read('index.html'), 'untouched')
+
+		one.alias = 'uno'
+		one.save()
+		export()
+		self.assertFalse(self._exported('one.html'))
+		self.assertEqual(read('uno.html'), 'Testchanged')
+
+		Page.objects.filter(alias='uno').update(status='D')
+		export()
+		self.assertTrue(self._exported('uno.html'))
+		self.client.login(username='me', password='me')
+		self.client.post('/admin/content/page/', data={
+			'action': 'change_status',
+			'action-status': 'D',
+			'_selected_action': [one.pk],
+		})
+		export()
+		self.assertFalse(self._exported('uno.html'))
+		self.assertEqual(read('index.html'), 'untouched')
+
+		old_url = self.entry.get_absolute_url()
+		self.assertTrue(self._exported(old_url[1:] + '.html'))
+		self.entry.slug = 'renamed'
+		self.entry.save()
+		export()
+		self.assertFalse(self._exported(old_url[1:] + '.html'))
+		self.assertTrue(self._exported(self.entry.get_absolute_url()[1:] + '.html'))
+		self.assertEqual(ContentChange.objects.count(), 1)
+
+	def test_pruned_changes(self):
+		other = tempfile.mkdtemp()
+		try:
+			call_command('export_site', other, jobs=1, incremental=True, stdout=open(os.devnull, 'w'))
+			with open(os.path.join(other, 'index.html'), 'w') as f:
+				f.write('old')
+			Page.objects.get(alias='one').save()
+			Page.objects.get(alias='one').save()
+			call_command(
+				'export_site', self.output, jobs=1, incremental=True, stdout=open(os.devnull, 'w')
+			)
+			# The changes the other export needs are gone, so it starts again.
+			call_command('export_site', other, jobs=1, incremental=True, stdout=open(os.devnull, 'w'))
+			with open(os.path.join(other, 'index.html')) as f:
+				self.assertEqual(f.read(), 'Testhome')
+		finally:
+			shutil.rmtree(other)
+
+
 class VersioningTestCase(TestCase):
 	def setUp(self):
 		self.me = User.objects.create_superuser(username='me', email=None, password='me')
@@ -312,6 +1407,49 @@ class VersioningTestCase(TestCase):
 		self.assertEqual(revision.title, 'test 3')
 		self.assertEqual(revision.content, '<p>This is a third test</p>')
 
+	def test_bulk_update(self):
+		for alias in ['a', 'b', 'c']:
+			page = self._create_page(save=False)
+			page.alias = alias
+			page.content = 'content of ' + alias
+			page.save()
+		pages = Page.objects.filter(alias__in=['a', 'b'])
+
+		self.assertEqual(Page.bulk_update(pages, self.me, status='D'), 2)
+		for alias, status in [('a', 'D'), ('b', 'D'), ('c', 'P')]:
+			page = Page.objects.get(alias=alias)
+			self.assertEqual(page.status, status)
+			revision = page.revisions.last()
+			self.assertEqual(revision.content, 'content of ' + alias)
+		self.assertEqual(Page.objects.get(alias='a').revisions.count(), 2)
+		self.assertEqual(Page.objects.get(alias='a').revisions.last().type, 'D')
+		self.assertEqual(
+			set(ContentChange.objects.filter(kind='P').values_list('path', flat=True)),
+			set(['/a', '/b', '/c'])
+		)
+
+		# Later revisions are stored against the bulk ones as usual.
+		page = Page.objects.get(alias='b')
+		page.content += '!'
+		page.save()
+		self.assertEqual(page.revisions.last().content, 'content of b!')
+
+	def test_history_diff(self):
+		page = self._create_page(save=False)
+		page.content = 'one\ntwo\nthree'
+		page.save()
+		page.content = 'one\n2\nthree\nfour <b>'
+		page.save()
+		revision = page.revisions.last()
+
+		url = '/admin/content/page/1/history/?revision=%d' % revision.pk
+		response = self.client.get(url)
+		self.assertEqual(response.status_code, 200)
+		self.assertContains(response, '<span class="diff_chg">two</span>')
+		self.assertContains(response, '<span class="diff_add">four &lt;b&gt;</span>')
+		previous = page.revisions.filter(pk__lt=revision.pk).last()
+		self.assertIsNotNone(get_cached_diff(previous.pk, revision.pk))
+
 	def test_change_form_history(self):
 		page = self._create_page(save=False)
 		page.save()
@@ -370,3 +1508,46 @@ class VersioningTestCase(TestCase):
 		self.assertEqual(revision.type, 'H')
 		self.assertEqual(revision.title, 'test 3')
 		self.assertEqual(revision.content, '<p>This is a third test</p>')
+
+
+class PageChangeListTestCase(TestCase):
+	def setUp(self):
+		self.me = User.objects.create_superuser(username='me', email=None, password='me')
+		self.client = Client()
+		self.client.login(username='me', password='me')
+
+	def test_changelist_queries(self):
+		def count_queries():
+			with CaptureQueriesContext(connection) as queries:
+				response = self.client.get('/admin/content/page/')
+			self.assertEqual(response.status_code, 200)
+			return len(queries)
+
+		parent = Page.objects.create(
+			alias='test',
+			title='test',
+			content='',
+			modified=now(),
+			modifier=self.me,
+			status='P',
+			template='test.html',
+		)
+		few = count_queries()
+		for i in range(20):
+			Page.objects.create(
+				alias='child-%d' % i,
+				parent=parent,
+				title='test',
+				content='',
+				modified=now(),
+				modifier=self.me,
+				status='P',
+				template='test.html',
+			)
+		self.assertEqual(count_queries(), few)
+
+		response = self.client.get('/admin/content/page/')
+		self.assertContains(response, 'href="/test/child-7"')
+		self.assertContains(response, '[%s]' % ', '.join(
+			str(pk) for pk in Page.objects.filter(parent=parent).values_list('pk', flat=True)
+		))
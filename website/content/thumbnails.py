@@ -0,0 +1,421 @@
+from datetime import timedelta
+from hashlib import md5
+from multiprocessing import Pool, TimeoutError, cpu_count
+import binascii, errno, os, time
+
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.encoding import force_text
+from easy_thumbnails.alias import aliases
+from easy_thumbnails.conf import settings as thumbnail_settings
+from easy_thumbnails.models import Source, Thumbnail
+
+from content import images
+from content.models import MediaImage
+from website import settings
+
+try:
+	import resource
+except ImportError:
+	# Not on Windows, where memory_limit does nothing.
+	resource = None
+
+# How long the thumbnails of one image can take to make in a worker.
+JOB_TIMEOUT = 300
+# How long a thumbnail can take to make before someone else tries. No less
+# than a job can take, so a worker's lock isn't taken over while it works.
+LOCK_TIMEOUT = JOB_TIMEOUT
+# Where the locks are kept, in THUMBNAIL_BASEDIR.
+LOCK_DIR = '.locks'
+
+
+def _get_lock_path(path, alias):
+	name = md5(('%s\n%s' % (path, alias)).encode('utf-8')).hexdigest()
+	return os.path.join(settings.MEDIA_ROOT, thumbnail_settings.THUMBNAIL_BASEDIR, LOCK_DIR, name)
+
+
+def _lock(lock_path):
+	# Returns the token to unlock with if this process got the lock, or None.
+	# Files are used, rather than the cache, so it works across processes
+	# whatever CACHES is.
+	token = binascii.hexlify(os.urandom(16))
+	folder = os.path.dirname(lock_path)
+	if not os.path.isdir(folder):
+		try:
+			os.makedirs(folder)
+		except OSError:
+			pass  # Made by someone else in the meantime.
+	for attempt in range(2):
+		try:
+			fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+		except OSError as e:
+			if e.errno != errno.EEXIST:
+				raise
+		else:
+			try:
+				os.write(fd, token)
+			finally:
+				os.close(fd)
+			return token
+		# Taken over if whoever has it has taken too long, e.g. because they died.
+		try:
+			if time.time() - os.path.getmtime(lock_path) < LOCK_TIMEOUT:
+				return None
+			os.unlink(lock_path)
+		except OSError:
+			pass  # Let go of in the meantime.
+	return None
+
+
+def _unlock(lock_path, token):
+	# Only if it's still this process's lock, rather than one someone else
+	# took over after LOCK_TIMEOUT.
+	try:
+		with open(lock_path, 'rb') as f:
+			if f.read() != token:
+				return
+		os.unlink(lock_path)
+	except (IOError, OSError):
+		pass  # Taken over and let go of in the meantime.
+
+
+def make_thumbnail(image, alias, wait=0):
+	# Returns the name of the thumbnail, relative to MEDIA_ROOT. Only one
+	# process makes each thumbnail at a time. The others wait up to wait
+	# seconds for it, then get None.
+	lock_path = _get_lock_path(image.path, alias)
+	deadline = time.time() + wait
+	while True:
+		token = _lock(lock_path)
+		if token is not None:
+			break
+		if time.time() >= deadline:
+			return None
+		time.sleep(0.1)
+		image.refresh_from_db(fields=['thumbnails'])
+		name = image.get_thumbnails().get(alias)
+		if name is not None:
+			return name
+
+	try:
+		options = aliases.get(alias, target=image.path)
+		name = images.get_alias_thumbnailer(image.path, alias).get_thumbnail(options).name
+		images.record_thumbnail(image.path, alias, name)
+		return name
+	finally:
+		_unlock(lock_path, token)
+
+
+def generate_thumbnails(path):
+	# Makes the thumbnails of path, relative to MEDIA_ROOT, that don't exist
+	# and aren't being made by someone else.
+	image = MediaImage.objects.filter(path=path).first()
+	if image is not None:
+		for alias in get_missing_aliases(image):
+			make_thumbnail(image, alias)
+	return path
+
+
+def get_missing_aliases(image):
+	if images.is_svg(image.path):
+		return []
+	made = image.get_thumbnails()
+	missing = []
+	for alias in aliases.all(target=image.path):
+		width = images.get_variant_width(alias)
+		# Variants are only made smaller than the image itself.
+		if alias not in made and (width is None or (image.width or 0) > width):
+			missing.append(alias)
+	return missing
+
+
+def get_stale_aliases(image):
+	# The aliases image has thumbnails for that were made with options that
+	# have since changed, or for aliases that are gone, or whose files are gone.
+	configured = aliases.all(target=image.path)
+	stale = []
+	for alias, name in image.get_thumbnails().items():
+		options = configured.get(alias)
+		thumbnailer = images.get_alias_thumbnailer(image.path, alias)
+		if options is None or name not in (
+			thumbnailer.get_thumbnail_name(options),
+			thumbnailer.get_thumbnail_name(options, transparent=True),
+		) or not os.path.exists(os.path.join(settings.MEDIA_ROOT, name)):
+			stale.append(alias)
+	return stale
+
+
+def forget_stale(image):
+	# Returns whether there were any.
+	if not get_stale_aliases(image):
+		return False
+	with transaction.atomic():
+		# Other processes may be recording thumbnails of the same image.
+		locked = images.lock_image(image.path)
+		if locked is None:
+			return False
+		image.thumbnails = locked.thumbnails
+		thumbnails = image.get_thumbnails()
+		for alias in get_stale_aliases(image):
+			del thumbnails[alias]
+		image.set_thumbnails(thumbnails)
+		image.save(update_fields=['thumbnails'])
+	return True
+
+
+def enqueue(paths):
+	# Leaves the thumbnails of the images at paths to the make_thumbnails
+	# command, or makes them now if there are no THUMBNAIL_WORKERS.
+	paths = [p for p in paths if not images.is_svg(p)]
+	if settings.THUMBNAIL_WORKERS == 0:
+		for path in paths:
+			generate_thumbnails(path)
+		return
+	for i in range(0, len(paths), 500):
+		# Unclaimed too, so those being made already are made again.
+		MediaImage.objects.filter(path__in=paths[i:i + 500]).update(pending=True, claimed=None)
+
+
+def take_pending(limit, timeout=JOB_TIMEOUT):
+	# Claims up to limit pending images, counting those still pending whose
+	# claim is more than timeout seconds old. They stay pending until
+	# finish_pending, so if this process dies they're taken on again later.
+	now = timezone.now()
+	claimable = MediaImage.objects.filter(
+		Q(claimed__isnull=True) | Q(claimed__lt=now - timedelta(seconds=timeout)), pending=True
+	)
+	paths = list(claimable.order_by('pk').values_list('path', flat=True)[:limit])
+	if not paths:
+		return []
+	claimable.filter(path__in=paths).update(claimed=now)
+	# Less any another process claimed in the meantime.
+	return list(
+		MediaImage.objects.filter(path__in=paths, claimed=now).order_by('pk')
+		.values_list('path', flat=True)
+	)
+
+
+def finish_pending(path, rest=()):
+	# For after one of take_pending's images is done with, or failed. If it was
+	# enqueued again in the meantime it was unclaimed, so it stays pending.
+	# The claim on the rest, which are still to be done, starts afresh.
+	MediaImage.objects.filter(path=path, claimed__isnull=False).update(pending=False, claimed=None)
+	rest = list(rest)
+	for i in range(0, len(rest), 500):
+		MediaImage.objects.filter(path__in=rest[i:i + 500], claimed__isnull=False).update(
+			claimed=timezone.now()
+		)
+
+
+def _limit_memory(megabytes):
+	if resource is not None and megabytes:
+		limit = megabytes * 1024 * 1024
+		resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _generate(path):
+	# Returns path and the error, if making its thumbnails failed.
+	try:
+		generate_thumbnails(path)
+		return path, None
+	except Exception as e:
+		# Passed back from the workers, which can't send tracebacks along.
+		return path, repr(e)
+
+
+def generate_all(paths, jobs=None, memory_limit=0, timeout=JOB_TIMEOUT):
+	# Makes the thumbnails of paths in jobs processes, or one per CPU if jobs
+	# is None, or in this process if it's 0. Yields (path, error) as each is
+	# done. memory_limit is the most megabytes each process can use.
+	if jobs == 0:
+		for path in paths:
+			yield _generate(path)
+		return
+
+	# The workers mustn't share this process's database connections.
+	connections.close_all()
+	# Start afresh now and then, in case Pillow holds on to memory.
+	pool = Pool(jobs or cpu_count(), _limit_memory, (memory_limit,), maxtasksperchild=100)
+	try:
+		results = [(path, pool.apply_async(_generate, (path,))) for path in paths]
+		for path, result in results:
+			try:
+				yield result.get(timeout)
+			except TimeoutError:
+				# The pool replaces a worker that's killed, e.g. for running
+				# out of memory, but what it was doing is never done.
+				yield path, 'Not done within %d seconds, or its worker died.' % timeout
+	finally:
+		pool.terminate()
+		pool.join()
+
+
+def _unlink(name):
+	try:
+		os.unlink(os.path.join(settings.MEDIA_ROOT, name))
+	except OSError:
+		pass
+
+
+def _get_names(paths):
+	# Every thumbnail of the images at paths that easy-thumbnails or the index
+	# knows about.
+	names = set(Thumbnail.objects.filter(source__name__in=paths).values_list('name', flat=True))
+	for image in MediaImage.objects.filter(path__in=paths):
+		names.update(image.get_thumbnails().values())
+	return names
+
+
+def delete_thumbnails(paths):
+	# Removes the thumbnails of the images at paths, relative to MEDIA_ROOT,
+	# from the disk and the database. Call before removing them from the index.
+	paths = list(paths)
+	for i in range(0, len(paths), 500):
+		batch = paths[i:i + 500]
+		for name in _get_names(batch):
+			_unlink(name)
+		# Takes their Thumbnail rows along.
+		Source.objects.filter(name__in=batch).delete()
+
+
+def move_thumbnails(old_path, new_path):
+	# Moves the thumbnails of an image that moved from old_path to new_path
+	# along with it. Returns their old names mapped to the new ones, for
+	# images.move_image.
+	if old_path == new_path:
+		return {}
+	delete_thumbnails([new_path])
+
+	# Thumbnails are named after their image and the folder it's in, e.g.
+	# thumbnails/images/a.png.150x120_q85.png for images/a.png.
+	old_folder = os.path.join(thumbnail_settings.THUMBNAIL_BASEDIR, os.path.dirname(old_path))
+	new_folder = os.path.join(thumbnail_settings.THUMBNAIL_BASEDIR, os.path.dirname(new_path))
+	renamed = {}
+	for name in _get_names([old_path]):
+		if os.path.basename(old_path) != os.path.basename(new_path) or \
+				not name.startswith(old_folder + '/'):
+			# Made again under the right name when it's next needed.
+			_unlink(name)
+			continue
+		new_name = os.path.join(new_folder, os.path.relpath(name, old_folder))
+		try:
+			os.renames(os.path.join(settings.MEDIA_ROOT, name), os.path.join(settings.MEDIA_ROOT, new_name))
+		except OSError:
+			continue
+		renamed[name] = new_name
+
+	for pk, name in Thumbnail.objects.filter(source__name=old_path).values_list('pk', 'name'):
+		if name in renamed:
+			Thumbnail.objects.filter(pk=pk).update(name=renamed[name])
+		else:
+			Thumbnail.objects.filter(pk=pk).delete()
+	Source.objects.filter(name=old_path).update(name=new_path)
+	return renamed
+
+
+def _get_indexed(paths):
+	# The names of the thumbnails in the index of those images at paths that
+	# are indexed.
+	paths = [force_text(path) for path in paths]
+	indexed = {}
+	for i in range(0, len(paths), 500):
+		for image in MediaImage.objects.filter(path__in=paths[i:i + 500]):
+			indexed[image.path] = set(image.get_thumbnails().values())
+	return indexed
+
+
+def _get_image(name, listing):
+	# The image, relative to MEDIA_ROOT, that a thumbnail file was made from,
+	# or None if it's gone. listing holds the last folder looked in, as the
+	# files come a folder at a time.
+	folder = os.path.dirname(os.path.relpath(name, thumbnail_settings.THUMBNAIL_BASEDIR))
+	if listing.get('folder') != folder:
+		listing['folder'] = folder
+		try:
+			listing['names'] = set(os.listdir(os.path.join(settings.MEDIA_ROOT, folder)))
+		except OSError:
+			listing['names'] = set()
+		listing['indexed'] = _get_indexed(os.path.join(folder, n) for n in listing['names'])
+	filename = os.path.basename(name)
+	if filename.startswith(thumbnail_settings.THUMBNAIL_PREFIX):
+		filename = filename[len(thumbnail_settings.THUMBNAIL_PREFIX):]
+	# The image's name is followed by the thumbnail's options.
+	for i in range(len(filename) - 1, 0, -1):
+		if filename[i] == '.' and filename[:i] in listing['names']:
+			return force_text(os.path.join(folder, filename[:i]))
+	return None
+
+
+def _is_stale(name, path, indexed, mtime):
+	# Whether a thumbnail of a live image is one its index entry has moved on
+	# from. Those just made may not be in the index yet.
+	return path in indexed and force_text(name) not in indexed[path] and \
+		time.time() - mtime > LOCK_TIMEOUT
+
+
+def collect_garbage(dry_run=False, batch_size=500):
+	# Removes thumbnail files and easy-thumbnails rows whose image is gone, or
+	# that the index of their image doesn't list, and rows whose file is gone.
+	# Returns how many files and rows there were.
+	files = 0
+	listing = {}
+	folder = os.path.join(settings.MEDIA_ROOT, thumbnail_settings.THUMBNAIL_BASEDIR)
+	locks = os.path.join(thumbnail_settings.THUMBNAIL_BASEDIR, LOCK_DIR) + '/'
+	for name, size, mtime in images.walk(folder) if os.path.isdir(folder) else []:
+		if name.startswith(locks):
+			# Left behind by a process that died.
+			garbage = time.time() - mtime > LOCK_TIMEOUT
+		else:
+			path = _get_image(name, listing)
+			garbage = path is None or _is_stale(name, path, listing['indexed'], mtime)
+		if garbage:
+			files += 1
+			if not dry_run:
+				_unlink(name)
+
+	def exists(name):
+		return os.path.isfile(os.path.join(settings.MEDIA_ROOT, name))
+
+	def get_mtime(name):
+		return os.path.getmtime(os.path.join(settings.MEDIA_ROOT, name))
+
+	rows = 0
+	last = 0
+	while True:
+		sources = list(
+			Source.objects.filter(pk__gt=last).order_by('pk').values_list('pk', 'name')[:batch_size]
+		)
+		if not sources:
+			break
+		last = sources[-1][0]
+		gone = [pk for pk, name in sources if not exists(name)]
+		rows += len(gone) + Thumbnail.objects.filter(source__in=gone).count()
+		if not dry_run:
+			for name in Thumbnail.objects.filter(source__in=gone).values_list('name', flat=True):
+				_unlink(name)
+			Source.objects.filter(pk__in=gone).delete()
+
+	last = 0
+	while True:
+		thumbnails = list(
+			Thumbnail.objects.filter(pk__gt=last).order_by('pk')
+			.values_list('pk', 'name', 'source__name')[:batch_size]
+		)
+		if not thumbnails:
+			break
+		last = thumbnails[-1][0]
+		indexed = _get_indexed(set(path for pk, name, path in thumbnails))
+		# Those whose image is gone too were counted above. Stale ones whose
+		# file is gone by now were removed above, unless it's a dry run.
+		gone = [
+			(pk, path) for pk, name, path in thumbnails
+			if exists(path) and (not exists(name) or _is_stale(name, path, indexed, get_mtime(name)))
+		]
+		rows += len(gone)
+		if not dry_run and gone:
+			Thumbnail.objects.filter(pk__in=[pk for pk, path in gone]).delete()
+			# Otherwise the index would still point at them.
+			for image in MediaImage.objects.filter(path__in=set(path for pk, path in gone)):
+				forget_stale(image)
+	return files, rows
@@ -1,46 +1,115 @@
 from datetime import date
-import os, re
+from hashlib import md5
+import calendar, json, os, re
 
 from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import permission_required
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.core.urlresolvers import reverse
-from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse
+from django.db.models import Q
+from django.http import (
+	Http404, HttpResponse, HttpResponseBadRequest, HttpResponsePermanentRedirect,
+	HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+)
 from django.shortcuts import get_object_or_404, render
 from django.template import loader
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.encoding import force_bytes
 from django.utils.feedgenerator import Atom1Feed
+from django.utils.http import http_date, quote_etag
 from django.utils.safestring import mark_safe
+from django.utils.text import compress_string
 from django.utils.translation import ngettext
-from django.views.decorators.http import last_modified
 
 from easy_thumbnails.alias import aliases
-from easy_thumbnails.files import get_thumbnailer
 
-from content.models import BlogEntry, Page, PageHistory
+from content.cache import (
+	get_cached_feed, get_cached_page, get_cached_page_list, page_list_cache_key, set_cached_feed,
+	set_cached_page, set_cached_page_list
+)
+from content import images, search, thumbnails
+from content.models import (
+	BlogEntry, MediaImage, MenuEntry, Page, PageHistory, PageRedirect, make_path_hash
+)
+from content.pagination import KeysetPage, make_cursor, parse_cursor
+from content.responsive import add_srcset, find_images, get_images_signature
+from layout.models import get_template_modified
 from website import settings
 
+BLOG_ENTRIES_PER_PAGE = 5
+
+
+def _is_public(request):
+	return request.method in ('GET', 'HEAD') and not request.user.is_authenticated
+
+
+def _is_cacheable(request):
+	return _is_public(request) and not request.GET
+
+
+def _get_validators(request, template, modified, *keys):
+	menu_modified = MenuEntry.get_modified()
+	times = [get_template_modified(template)]
+	for t in (modified, menu_modified):
+		if t is not None:
+			times.append(calendar.timegm(t.utctimetuple()))
+	etag = md5(force_bytes(
+		repr((request.get_full_path(), modified, menu_modified, times) + keys)
+	)).hexdigest()
+	return quote_etag(etag), int(max(t for t in times if t is not None))
 
-def page(request, extra_context=None):
-	alias = request.path[request.path.rfind('/') + 1:]
-	if request.path == '/':
-		alias = 'home'
-	page = get_object_or_404(Page, alias=alias)
 
-	url = page.get_absolute_url()
-	if request.path != url:
-		return HttpResponseRedirect(url)
+def _set_validators(response, etag, last_modified):
+	response['ETag'] = etag
+	if last_modified is not None:
+		response['Last-Modified'] = http_date(last_modified)
+	return response
+
+
+def page(request, extra_context=None):
+	cacheable = extra_context is None and _is_cacheable(request)
+	if cacheable:
+		cached = get_cached_page(request.path)
+		if cached is not None:
+			content, content_type, etag, last_modified = cached
+			response = HttpResponse(content, content_type=content_type)
+			_set_validators(response, etag, last_modified)
+			return get_conditional_response(request, etag, last_modified, response)
 
 	is_editor = request.user.has_perm('content.add_page')
+
+	try:
+		page = Page.objects.get(path_hash=make_path_hash(request.path))
+	except Page.DoesNotExist:
+		redirect = get_object_or_404(
+			PageRedirect.objects.select_related('page'), old_path_hash=make_path_hash(request.path)
+		)
+		if not is_editor and redirect.page.status != 'P':
+			raise Http404
+		return HttpResponseRedirect(redirect.page.get_absolute_url())
+
 	if not is_editor and page.status != 'P':
 		raise Http404
 
+	found = find_images(page.content)
+	public = extra_context is None and _is_public(request)
+	if public:
+		etag, last_modified = _get_validators(
+			request, page.template, page.modified,
+			page.pk, page.status, page.template, page.content_hash,
+			get_images_signature(page.content, found)
+		)
+		response = get_conditional_response(request, etag, last_modified)
+		if response is not None:
+			return _set_validators(response, etag, last_modified)
+
 	if is_editor and 'revision' in request.GET:
 		try:
 			version = page.revisions.get(pk=request.GET['revision'])
 			page.title = version.title
 			page.content = version.content
 			page.extra_header_content = version.extra_header_content
+			found = find_images(page.content)
 		except PageHistory.DoesNotExist:
 			raise Http404
 
@@ -49,26 +118,81 @@ def page(request, extra_context=None):
 		'page': page,
 		'alias': page.alias,
 		'title': page.title,
-		'content': mark_safe(page.content),
+		'content': mark_safe(add_srcset(page.content, found)),
 		'extra_header_content': mark_safe(page.extra_header_content),
 	}
 	context.update(extra_context or {})
 
-	return render(request, page.template, context)
+	response = render(request, page.template, context)
+	if public:
+		_set_validators(response, etag, last_modified)
+	if cacheable:
+		set_cached_page(request.path, response, etag, last_modified)
+	return response
+
+
+def _page_list_json(pages, cache_key):
+	# Sends the list a batch at a time, and caches it once it has all gone.
+	chunks = ['[']
+	yield chunks[0]
+	batch = []
+	for path, title, status, tree_id, lft in pages:
+		batch.append(json.dumps({
+			'url': path, 'title': title, 'status': status, 'cursor': '%d-%d' % (tree_id, lft)
+		}))
+		if len(batch) == 200:
+			chunks.append((',' if len(chunks) > 1 else '') + ','.join(batch))
+			yield chunks[-1]
+			batch = []
+	chunks.append((',' if len(chunks) > 1 and batch else '') + ','.join(batch) + ']')
+	yield chunks[-1]
+	set_cached_page_list(cache_key, ''.join(chunks))
 
 
 @staff_member_required
 def all_pages(request):
-	pages = list()
-
-	for p in Page.objects.all():
-		pages.append({
-			'url': p.get_absolute_url(),
-			'title': p.title,
-			'status': p.status
-		})
+	# Pages in tree order, for the link picker. ?prefix= only lists paths that
+	# start with it, and ?limit= lists that many, after the page whose cursor
+	# is ?after=.
+	cache_key = page_list_cache_key(request.GET.urlencode())
+	etag = quote_etag(md5(force_bytes(cache_key)).hexdigest())
+	response = get_conditional_response(request, etag)
+	if response is not None:
+		response['ETag'] = etag
+		return response
+
+	content = get_cached_page_list(cache_key)
+	if content is not None:
+		response = HttpResponse(content, content_type='application/json')
+	else:
+		try:
+			limit = int(request.GET['limit']) if 'limit' in request.GET else None
+			after = [int(i) for i in request.GET['after'].split('-')] if 'after' in request.GET else None
+			if after is not None and len(after) != 2:
+				raise ValueError
+		except ValueError:
+			return HttpResponseBadRequest()
+
+		# Ordered like the index on (tree_id, lft), so that each batch starts
+		# where the last one stopped instead of counting past the ones before.
+		pages = Page.objects.order_by('tree_id', 'lft').values_list(
+			'path', 'title', 'status', 'tree_id', 'lft'
+		)
+		if request.GET.get('prefix'):
+			pages = pages.filter(path__startswith=request.GET['prefix'])
+		if after is not None:
+			tree_id, lft = after
+			pages = pages.filter(Q(tree_id__gt=tree_id) | Q(lft__gt=lft), tree_id__gte=tree_id)
+		if limit is not None:
+			pages = pages[:max(limit, 0)]
+		response = StreamingHttpResponse(
+			_page_list_json(pages.iterator(), cache_key), content_type='application/json'
+		)
 
-	return JsonResponse(sorted(pages, key=lambda x: x['url']), safe=False)
+	response['ETag'] = etag
+	# Editors' browsers can keep it, but must check it's still current.
+	patch_cache_control(response, private=True, max_age=0)
+	return response
 
 
 def blog_list(request, year=None, date=None, tag=None, extra_context=None):
@@ -77,37 +201,30 @@ def blog_list(request, year=None, date=None, tag=None, extra_context=None):
 	elif date:
 		entry_list = BlogEntry.objects.filter(created__year=date[0:4], created__month=date[5:7])
 	elif tag:
-		regex = r'(^| )' + tag + r'( |$)'
-		entry_list = BlogEntry.objects.filter(tags__regex=regex)
+		entry_list = BlogEntry.objects.filter(tag_set__name=tag)
 	else:
 		entry_list = BlogEntry.objects.all()
 
-	if not request.user.has_perm('content.add_blogentry'):
+	is_editor = request.user.has_perm('content.add_blogentry')
+	if not is_editor:
 		entry_list = entry_list.filter(status='P')
 
 	entry_list = entry_list.order_by('-created')
 
 	if 'atom' in request.GET:
-		return _atom_blog_list(request, entry_list)
+		return _atom_blog_list(request, entry_list, public=not is_editor)
 	else:
 		return _html_blog_list(request, entry_list, extra_context)
 
 
-def _last_entry(request, entry_list):
-	if not entry_list.exists():
-		return None
-
-	return entry_list.latest('modified').modified
-
-
-@last_modified(_last_entry)
-def _atom_blog_list(request, entry_list):
+def _build_feed(link, entry_list):
 	feed = Atom1Feed(
 		title=settings.SITE_NAME,
 		description=None,
-		link='%s://%s%s' % (request.scheme, request.META['HTTP_HOST'], request.path)
+		link=link
 	)
-	for entry in entry_list[:5]:
+	entries = list(entry_list[:5])
+	for entry in entries:
 		feed.add_item(
 			title=entry.title,
 			description=entry.content,
@@ -115,21 +232,65 @@ def _atom_blog_list(request, entry_list):
 			pubdate=entry.created,
 			updateddate=entry.modified,
 		)
-	xml = feed.writeString('UTF-8')
-	return HttpResponse(xml, content_type='application/atom+xml; charset=utf-8')
+	xml = force_bytes(feed.writeString('UTF-8'))
+
+	last_modified = None
+	if entries:
+		last_modified = calendar.timegm(max(e.modified for e in entries).utctimetuple())
+	return xml, compress_string(xml), quote_etag(md5(xml).hexdigest()), last_modified
+
+
+def _atom_blog_list(request, entry_list, public=False):
+	# Feed readers poll constantly, so the public feeds are built once after
+	# each change and kept in the cache, along with a gzipped copy.
+	link = '%s://%s%s' % (request.scheme, request.get_host(), request.path)
+	feed = get_cached_feed(link) if public else None
+	if feed is None:
+		feed = _build_feed(link, entry_list)
+		if public:
+			set_cached_feed(link, feed)
+	xml, compressed, etag, last_modified = feed
+
+	response = HttpResponse(content_type='application/atom+xml; charset=utf-8')
+	if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+		response.content = compressed
+		response['Content-Encoding'] = 'gzip'
+		# The bytes differ, so the strong ETag must too.
+		etag = etag[:-1] + '-gzip"'
+	else:
+		response.content = xml
+	patch_vary_headers(response, ('Accept-Encoding',))
+
+	response['ETag'] = etag
+	if last_modified is not None:
+		response['Last-Modified'] = http_date(last_modified)
+	return get_conditional_response(request, etag, last_modified, response)
 
 
 def _html_blog_list(request, entry_list, extra_context=None):
-	paginator = Paginator(entry_list, 5)
-	page = request.GET.get('page')
-	try:
-		entries = paginator.page(page)
-	except PageNotAnInteger:
-		# If page is not an integer, deliver first page.
-		entries = paginator.page(1)
-	except EmptyPage:
-		# If page is out of range (e.g. 9999), deliver last page of results.
-		entries = paginator.page(paginator.num_pages)
+	if 'page' in request.GET:
+		return _redirect_to_cursor(request, entry_list)
+
+	entries = KeysetPage(
+		entry_list, BLOG_ENTRIES_PER_PAGE,
+		before=parse_cursor(request.GET.get('before')),
+		after=parse_cursor(request.GET.get('after')),
+	)
+
+	public = extra_context is None and _is_public(request)
+	if public:
+		etag, last_modified = _get_validators(
+			request, settings.NEWS_TEMPLATE_NAME,
+			max([e.modified for e in entries] or [None]),
+			[(e.pk, e.modified) for e in entries], entries.has_previous, entries.has_next,
+			get_images_signature(''.join(e.content for e in entries))
+		)
+		# Deleting or unpublishing an entry leaves no date behind to go by, so
+		# only the ETag can tell whether the list changed.
+		last_modified = None
+		response = get_conditional_response(request, etag, last_modified)
+		if response is not None:
+			return _set_validators(response, etag, last_modified)
 
 	context = {
 		'site_name': settings.SITE_NAME,
@@ -140,7 +301,27 @@ def _html_blog_list(request, entry_list, extra_context=None):
 	}
 	context.update(extra_context or {})
 
-	return render(request, settings.NEWS_TEMPLATE_NAME, context)
+	response = render(request, settings.NEWS_TEMPLATE_NAME, context)
+	if public:
+		_set_validators(response, etag, last_modified)
+	return response
+
+
+def _redirect_to_cursor(request, entry_list):
+	# Lists used to be paginated with ?page=N. Find where that page starts once
+	# and send old links to the cursor for it.
+	try:
+		page = int(request.GET['page'])
+	except ValueError:
+		page = 1
+	if page <= 1:
+		return HttpResponsePermanentRedirect(request.path)
+
+	offset = (page - 1) * BLOG_ENTRIES_PER_PAGE
+	previous = entry_list.order_by('-created', '-pk')[offset - 1:offset]
+	if not previous:
+		raise Http404
+	return HttpResponsePermanentRedirect('%s?before=%s' % (request.path, make_cursor(previous[0])))
 
 
 def blog_entry(request, date, slug, extra_context=None):
@@ -151,6 +332,16 @@ def blog_entry(request, date, slug, extra_context=None):
 	if not request.user.has_perm('content.add_blogentry') and entry.status != 'P':
 		raise Http404
 
+	public = extra_context is None and _is_public(request)
+	if public:
+		etag, last_modified = _get_validators(
+			request, settings.NEWS_TEMPLATE_NAME, entry.modified, entry.pk, entry.status,
+			entry.content_hash, get_images_signature(entry.content)
+		)
+		response = get_conditional_response(request, etag, last_modified)
+		if response is not None:
+			return _set_validators(response, etag, last_modified)
+
 	context = {
 		'site_name': settings.SITE_NAME,
 		'title': entry.title,
@@ -160,6 +351,51 @@ def blog_entry(request, date, slug, extra_context=None):
 	}
 	context.update(extra_context or {})
 
+	response = render(request, settings.NEWS_TEMPLATE_NAME, context)
+	if public:
+		_set_validators(response, etag, last_modified)
+	return response
+
+
+def search_results(request, extra_context=None):
+	query = request.GET.get('q', '')
+	results = []
+
+	if query:
+		published_only = []
+		if not request.user.has_perm('content.add_page'):
+			published_only.append('P')
+		if not request.user.has_perm('content.add_blogentry'):
+			published_only.append('B')
+		matches = search.search(query, published_only=published_only)
+		page_list = Page.objects.filter(
+			pk__in=[object_id for kind, object_id in matches if kind == 'P']
+		).only('path', 'title', 'status')
+		entry_list = BlogEntry.objects.filter(
+			pk__in=[object_id for kind, object_id in matches if kind == 'B']
+		).only('created', 'slug', 'title', 'status')
+		if not request.user.has_perm('content.add_page'):
+			page_list = page_list.filter(status='P')
+		if not request.user.has_perm('content.add_blogentry'):
+			entry_list = entry_list.filter(status='P')
+
+		found = {}
+		for p in page_list:
+			found[('P', p.pk)] = p
+		for e in entry_list:
+			found[('B', e.pk)] = e
+		results = [found[m] for m in matches if m in found]
+
+	context = {
+		'site_name': settings.SITE_NAME,
+		'title': 'Search',
+		'content': loader.render_to_string('content/search_results.html', {
+			'query': query,
+			'results': results,
+		})
+	}
+	context.update(extra_context or {})
+
 	return render(request, settings.NEWS_TEMPLATE_NAME, context)
 
 
@@ -177,16 +413,24 @@ def file_browser(request, template, path=None):
 		kwargs = {'template': template}
 		if 'upload' in request.FILES:
 			uploaded_count = 0
+			uploaded_images = []
 			for f in request.FILES.getlist('upload'):
 				new_file_name = re.sub(r'[^-\w \.]', '', f.name)
 				if new_file_name and (template != 'images' or f.content_type.startswith('image/')):
 					with open(os.path.join(root, new_file_name), 'wb') as destination:
 						for c in f.chunks():
 							destination.write(c)
+					if template == 'images':
+						image = images.index_image(
+							os.path.relpath(os.path.join(root, new_file_name), settings.MEDIA_ROOT)
+						)
+						uploaded_images.append(image.path)
 					uploaded_count += 1
 				else:
 					pass  # TODO
 
+			# Make the thumbnails now, rather than when someone first looks.
+			thumbnails.enqueue(uploaded_images)
 			if uploaded_count > 0:
 				messages.success(
 					request, '%d %s uploaded.' %
@@ -211,6 +455,10 @@ def file_browser(request, template, path=None):
 				file_path = os.path.join(root, n)
 				if os.path.exists(file_path):
 					os.unlink(file_path)
+					if template == 'images':
+						image_path = os.path.relpath(file_path, settings.MEDIA_ROOT)
+						thumbnails.delete_thumbnails([image_path])
+						images.remove_images([image_path])
 					deleted_count += 1
 			messages.success(
 				request, '%d %s deleted.' %
@@ -229,6 +477,10 @@ def file_browser(request, template, path=None):
 				destination_path = os.path.join(destination, n)
 
 				os.rename(source_path, destination_path)
+				if template == 'images':
+					old_path = os.path.relpath(source_path, settings.MEDIA_ROOT)
+					new_path = os.path.relpath(destination_path, settings.MEDIA_ROOT)
+					images.move_image(old_path, new_path, thumbnails.move_thumbnails(old_path, new_path))
 				moved_count += 1
 
 			messages.success(
@@ -278,6 +530,18 @@ def file_browser(request, template, path=None):
 				'size': os.path.getsize(f_path),
 			})
 
+	pending_count = 0
+	if template == 'images':
+		folder = os.path.relpath(root, settings.MEDIA_ROOT)
+		indexed = dict(
+			(image.path, image) for image in MediaImage.objects.filter(path__startswith=folder + '/')
+		)
+		for f in files:
+			image = indexed.get(f['path'])
+			f['thumb'] = image and image.get_thumbnails().get('thumb')
+			f['pending'] = image is not None and bool(thumbnails.get_missing_aliases(image))
+			pending_count += f['pending']
+
 	from website.admin import admin_site
 	context = dict(
 		# Include common variables for rendering the admin template.
@@ -288,48 +552,35 @@ def file_browser(request, template, path=None):
 		path=path,
 		dirs=dirs,
 		files=files,
+		pending_count=pending_count,
 	)
 	return render(request, 'admin/content/' + template[:-1] + '_browser.html', context)
 
 
 @staff_member_required
 def all_images(request):
-	root = os.path.join(settings.MEDIA_ROOT, 'images')
-
-	def do_folder(path):
-		images = list()
-		folders = list()
-		for p in os.listdir(path):
-			p = os.path.join(path, p)
-			if (os.path.isdir(p)):
-				folders.append(do_folder(p))
-			elif p[-4:].lower() == '.svg':
-				images.append({
-					'url': os.path.join(settings.MEDIA_URL, os.path.relpath(p, settings.MEDIA_ROOT)),
-					'thumb': os.path.join(settings.MEDIA_URL, os.path.relpath(p, settings.MEDIA_ROOT))
-				})
-				continue
-			else:
-				thumbnailer = get_thumbnailer(os.path.relpath(p, settings.MEDIA_ROOT))
-				existing = thumbnailer.get_existing_thumbnail(aliases.get('smallthumb'))
-				d = {
-					'url': os.path.join(settings.MEDIA_URL, os.path.relpath(p, settings.MEDIA_ROOT))
-				}
-				if existing is not None:
-					d['thumb'] = os.path.join(settings.MEDIA_URL, existing.name)
-				images.append(d)
-
-		return {
-			'path': os.path.relpath(path, root),
-			'images': sorted(images, key=lambda x: x['url'].lower()),
-			'folders': sorted(folders, key=lambda x: x['path'].lower())
-		}
-
-	return JsonResponse(do_folder(root), safe=False)
+	return JsonResponse(images.get_image_tree(), safe=False)
 
 
 def get_thumbnail(request):
-	t = get_thumbnailer(request.GET['f'])
-	s = request.GET.get('s', 'smallthumb')
-	g = t.get_thumbnail(aliases.get(s))
-	return HttpResponseRedirect(os.path.join(settings.MEDIA_URL, g.name))
+	path = request.GET.get('f', '')
+	alias = request.GET.get('s', 'smallthumb')
+	if aliases.get(alias, target=path) is None:
+		raise Http404
+
+	image = MediaImage.objects.filter(path=path).first()
+	if image is None:
+		# Not indexed yet, e.g. copied in since index_images last ran.
+		if os.path.normpath(path) != path or not path.startswith(images.IMAGES_DIR + '/') or \
+				not os.path.isfile(os.path.join(settings.MEDIA_ROOT, path)):
+			raise Http404
+		image = images.index_image(path)
+
+	name = image.get_thumbnails().get(alias)
+	if name is None and not images.is_svg(image.path) and settings.THUMBNAIL_WAIT:
+		name = thumbnails.make_thumbnail(image, alias, settings.THUMBNAIL_WAIT)
+	if name is None:
+		# Show the image itself until the thumbnail is ready.
+		thumbnails.enqueue([image.path])
+		return HttpResponseRedirect(os.path.join(settings.MEDIA_URL, image.path))
+	return HttpResponseRedirect(os.path.join(settings.MEDIA_URL, name))
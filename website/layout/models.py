@@ -15,6 +15,13 @@ def get_templates():
 	return templates
 
 
+def get_template_modified(name):
+	try:
+		return os.path.getmtime(os.path.join(settings.MEDIA_ROOT, 'templates', name))
+	except OSError:
+		return None
+
+
 class TemplateField(models.FilePathField):
 	def formfield(self, **kwargs):
 		kwargs.update({
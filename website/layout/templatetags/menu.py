@@ -1,15 +1,54 @@
+from hashlib import md5
+
 from django import template
+from django.core.cache import cache
 from django.utils.html import conditional_escape
 from django.utils.safestring import mark_safe
 
 from content.models import MenuEntry
+from website import settings
 
 register = template.Library()
 
+# The whole menu, loaded once per process and reloaded when it changes. Costs
+# a query per request to find out.
+_menu = (None, [], [])
+
+
+def get_menu():
+	global _menu
+	version = MenuEntry.get_modified()
+	if _menu[0] != version:
+		entries = list(MenuEntry.objects.all())
+		by_pk = {}
+		roots = []
+		for item in entries:
+			item.menu_children = []
+			by_pk[item.pk] = item
+		for item in entries:
+			if item.parent_id is None:
+				roots.append(item)
+			else:
+				by_pk[item.parent_id].menu_children.append(item)
+		_menu = (version, roots, entries)
+	return _menu
+
+
+def _contains(outer, inner):
+	return outer.tree_id == inner.tree_id and outer.lft < inner.lft and outer.rght > inner.rght
+
 
 @register.simple_tag(takes_context=True)
 def menu(context, max_depth=None):
 	path = context['request'].path
+	version, roots, entries = get_menu()
+
+	cache_key = 'layout:menu:%s:%s:%s' % (
+		version and version.strftime('%Y%m%d%H%M%S%f'), max_depth, md5(path.encode('utf-8')).hexdigest()
+	)
+	output = cache.get(cache_key)
+	if output is not None:
+		return mark_safe(output)
 
 	def list_formatter(item_list, depth=1):
 		if len(item_list) == 0 or (max_depth is not None and depth > max_depth):
@@ -39,20 +78,24 @@ def menu(context, max_depth=None):
 				tag = '<a href="%s">%s</a>' % (item.href, text)
 			else:
 				tag = '<span>%s</span>' % text
-			sublist = list_formatter(item.get_children(), depth + 1)
+			sublist = list_formatter(item.menu_children, depth + 1)
 
-			if not item.is_leaf_node():
+			if item.menu_children:
 				classes.append('has_children')
-			if current and item.is_ancestor_of(current):
+			if current and _contains(item, current):
 				classes.append('ancestor')
-			if current and item.is_descendant_of(current):
+			if current and _contains(current, item):
 				classes.append('descendant')
 			output.append('<li class="%s">%s%s</li>' % (' '.join(classes), tag, sublist))
 		output.append('</ul>')
 		return ''.join(output)
 
-	try:
-		current = MenuEntry.objects.get(href=path)
-	except MenuEntry.DoesNotExist:
-		current = None
-	return mark_safe(list_formatter(MenuEntry.objects.root_nodes()))
+	current = None
+	for item in entries:
+		if item.href == path:
+			current = item
+			break
+
+	output = list_formatter(roots)
+	cache.set(cache_key, output, settings.PAGE_CACHE_TIMEOUT)
+	return mark_safe(output)
@@ -9,6 +9,9 @@ from django.core.urlresolvers import reverse
 from django.http import HttpResponseRedirect
 from django.shortcuts import render
 
+from content.cache import invalidate_pages
+from content.models import ContentChange
+
 ROOTS = {
 	'css': os.path.join(settings.MEDIA_ROOT, 'css'),
 	'template': os.path.join(settings.MEDIA_ROOT, 'templates')
@@ -73,6 +76,8 @@ def layoutfile_change(request, file_type, file_name):
 	if request.method == 'POST':
 		with open(path, 'w') as f:
 			f.write(request.POST['file_content'].replace('\r', '').encode('utf-8'))
+		ContentChange.record('L', path='%s/%s' % (file_type, file_name))
+		invalidate_pages()
 		messages.success(request, 'Changes to %s "%s" saved.' % (type_name, file_name))
 		if request.POST.get('_continue'):
 			return HttpResponseRedirect(
@@ -125,7 +125,28 @@ THUMBNAIL_ALIASES = {
 		'smallthumb': {'size': (120, 96), 'crop': False},
 	},
 }
+# Widths of the smaller copies made of each image, which images in pages and
+# news entries offer as a srcset. They're made as thumbnails with aliases
+# named after their width (w480 and so on) and saved as IMAGE_VARIANT_FORMAT.
+IMAGE_VARIANT_WIDTHS = (480, 960, 1440, 1920)
+IMAGE_VARIANT_FORMAT = 'webp'
+THUMBNAIL_ALIASES[''].update(('w%d' % w, {'size': (w, 0)}) for w in IMAGE_VARIANT_WIDTHS)
 THUMBNAIL_BASEDIR = 'thumbnails'
+# Processes the make_thumbnails command uses to make thumbnails of uploaded
+# images in the background. None means one per CPU. 0 makes them during the
+# upload instead, so make_thumbnails needn't run.
+THUMBNAIL_WORKERS = None
+# get_thumbnail makes missing thumbnails, but if someone else is already
+# making one it waits at most this many seconds for them, then redirects to the
+# full image. 0 leaves them all to the background and redirects straight away.
+THUMBNAIL_WAIT = 5
+
+# Pages are cached for anonymous visitors until their content changes. The
+# default cache is per-process, so configure CACHES with a shared backend
+# (e.g. memcached) when running more than one process. Changes to the images
+# a cached page shows, such as new srcset variants, only appear once it
+# expires.
+PAGE_CACHE_TIMEOUT = 60 * 60
 
 SITE_NAME = 'Foo\'s Bar'
 NEWS_TEMPLATE_NAME = 'fruity.html'
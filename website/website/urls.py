@@ -20,5 +20,6 @@ urlpatterns += [
 		r'^news/(?P<date>\d{4}-\d{2})/(?P<slug>[-\w]+)$',
 		content.views.blog_entry, name='blog_entry'
 	),
+	url(r'^search/?$', content.views.search_results, name='search'),
 	url(r'^', content.views.page)
 ]